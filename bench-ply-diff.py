@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+
+def import_rerun_ply():
+    filepath = os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), 'rerun-ply.py')
+    spec = importlib.util.spec_from_file_location('rerun_ply', filepath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_diff_by_index(rerun_ply, num_points, churn, repeat):
+    rng = np.random.default_rng(42)
+    pre_positions = rng.random((num_points, 3))
+    positions = pre_positions.copy()
+    n_changed = int(num_points * churn)
+    positions[:n_changed] += 0.1
+    colors = np.zeros((num_points, 3), dtype=np.uint8)
+
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        changed_mask, added_cnt, deleted_cnt = rerun_ply.diff_by_index(
+            pre_positions, positions)
+        colors[:len(changed_mask)][changed_mask] = [255, 255, 0]
+        changed_cnt = int(np.count_nonzero(changed_mask))
+        elapsed.append(time.perf_counter() - start)
+    assert changed_cnt == n_changed
+    return min(elapsed)
+
+
+def bench_diff_by_position(rerun_ply, num_points, churn, repeat, backend):
+    rng = np.random.default_rng(42)
+    pre_positions = rng.random((num_points, 3))
+    positions = pre_positions.copy()
+    n_changed = int(num_points * churn)
+    positions[:n_changed] += 0.1
+
+    elapsed = []
+    for _ in range(repeat):
+        position_index = rerun_ply.PositionDiffIndex(backend=backend)
+        position_index.diff(pre_positions)
+        start = time.perf_counter()
+        added_mask, added_cnt, deleted_cnt = position_index.diff(positions)
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--num-points',
+        type=int,
+        nargs='+',
+        default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--churn', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--position-backends',
+        nargs='*',
+        default=['voxel'],
+        choices=['voxel', 'numpy'])
+    args = parser.parse_args()
+
+    rerun_ply = import_rerun_ply()
+    for num_points in args.num_points:
+        sec = bench_diff_by_index(
+            rerun_ply, num_points, args.churn, args.repeat)
+        print('diff_by_index {:>10} points: {:8.2f}ms/frame'.format(
+            num_points, sec * 1000.0))
+        for backend in args.position_backends:
+            sec = bench_diff_by_position(
+                rerun_ply, num_points, args.churn, args.repeat, backend)
+            print('diff_by_position({}) {:>10} points: {:8.2f}ms/frame'.format(
+                backend, num_points, sec * 1000.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic_scene
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_script(filename, name):
+    filepath = os.path.join(SCRIPT_DIR, filename)
+    spec = importlib.util.spec_from_file_location(name, filepath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_csv(filepath, num_rows, num_columns):
+    rng = np.random.default_rng(42)
+    table = np.column_stack((
+        np.arange(num_rows),
+        rng.random((num_rows, num_columns)) * 100.0))
+    header = ','.join(['id'] + ['c{}'.format(i) for i in range(num_columns)])
+    np.savetxt(filepath, table, delimiter=',', header=header,
+               comments='', fmt=['%d'] + ['%.6f'] * num_columns)
+
+
+def write_binary_ply(filepath, num_points):
+    rng = np.random.default_rng(42)
+    vertex = np.zeros(num_points, dtype=[
+        ('xyz', '<f8', (3,)), ('rgb', 'u1', (3,))])
+    vertex['xyz'] = rng.random((num_points, 3))
+    vertex['rgb'] = rng.integers(0, 256, (num_points, 3))
+    header = '\n'.join([
+        'ply',
+        'format binary_little_endian 1.0',
+        'element vertex {}'.format(num_points),
+        'property double x',
+        'property double y',
+        'property double z',
+        'property uchar red',
+        'property uchar green',
+        'property uchar blue',
+        'end_header',
+    ]) + '\n'
+    with open(filepath, 'wb') as f:
+        f.write(header.encode())
+        f.write(vertex.tobytes())
+
+
+def run_child(command):
+    # NOTE: one process per case, so ru_maxrss is the peak RSS of that case only
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    output = proc.stdout.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError('{} failed ({})'.format(command, proc.returncode))
+    return (output.decode(), elapsed, rusage.ru_maxrss / 1024.0)
+
+
+def bench_csv(tmpdir, num_rows, num_columns, mode):
+    csv_path = os.path.join(tmpdir, 'bench.csv')
+    if not os.path.exists(csv_path):
+        write_csv(csv_path, num_rows, num_columns)
+    rrd_path = os.path.join(tmpdir, 'csv-{}.rrd'.format(mode))
+    command = [sys.executable, os.path.join(SCRIPT_DIR, 'csv-pipe-rerun.py'),
+               '--save', rrd_path, '-i', csv_path]
+    if mode == 'batch':
+        command += ['--batch']
+    else:
+        command += ['--interval', '0', '--parser', 'numpy']
+    _, elapsed, peak_rss_mb = run_child(command)
+    return {
+        'bench': 'csv-pipe-rerun',
+        'mode': mode,
+        'rows': num_rows,
+        'columns': num_columns,
+        'sec': elapsed,
+        'rows_per_sec': num_rows / elapsed,
+        'bytes_per_frame': os.path.getsize(rrd_path) / num_rows,
+        'peak_rss_mb': peak_rss_mb,
+    }
+
+
+def case_ply_sender(case):
+    import rerun as rr
+    rerun_ply = import_script('rerun-ply.py', 'rerun_ply')
+    rr.init('bench', spawn=False)
+    rr.save(case['rrd_path'])
+
+    scene = synthetic_scene.SyntheticScene(
+        num_points=case['num_points'],
+        churn=case['churn'],
+        locality=case['locality'],
+        color_mode='none',
+        seed=42)
+    sender = rerun_ply.RerunPlySender(encoding=case['encoding'])
+    frame_sec = []
+    frame_bytes = []
+    for frame, point_cloud in enumerate(scene.frames(case['frames'])):
+        rr.set_time_sequence('id', frame)
+        start = time.perf_counter()
+        sender.log(
+            point_cloud,
+            splitting_method=case['splitting_method'],
+            enable_diff_by_index=case['diff'] == 'index',
+            enable_diff_by_position=case['diff'] == 'position')
+        frame_sec.append(time.perf_counter() - start)
+        frame_bytes.append(sender.frame_bytes['encoded'])
+    rr.disconnect()
+    return {
+        'frame_ms': [sec * 1000.0 for sec in frame_sec],
+        'points_per_sec': case['num_points'] * len(frame_sec) / sum(frame_sec),
+        'bytes_per_frame': float(np.mean(frame_bytes)),
+        'last_frame_stats': sender.frame_stats(),
+    }
+
+
+def case_ply_loader(case):
+    import trimesh
+    import ply_reader
+    start = time.perf_counter()
+    if case['loader'] == 'memmap':
+        point_cloud = ply_reader.read_binary_ply(case['ply_path'])
+    else:
+        point_cloud = trimesh.load(case['ply_path'])
+    # touch every vertex so lazy mappings are counted
+    checksum = float(np.asarray(point_cloud.vertices).sum())
+    elapsed = time.perf_counter() - start
+    return {
+        'sec': elapsed,
+        'points_per_sec': case['num_points'] / elapsed,
+        'checksum': checksum,
+    }
+
+
+def run_case(case):
+    if case['bench'] == 'ply-sender':
+        result = case_ply_sender(case)
+    else:
+        result = case_ply_loader(case)
+    print(json.dumps(result))
+
+
+def spawn_case(case):
+    output, _, peak_rss_mb = run_child(
+        [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)])
+    result = dict(case)
+    result.update(json.loads(output.strip().splitlines()[-1]))
+    result['peak_rss_mb'] = peak_rss_mb
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--num-points',
+        type=int,
+        nargs='+',
+        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument(
+        '--splitting-methods',
+        nargs='+',
+        default=['overall', 'order'])
+    parser.add_argument(
+        '--diff-modes',
+        nargs='+',
+        default=['none', 'index', 'position'])
+    parser.add_argument('--encoding', default='compact')
+    parser.add_argument('--frames', type=int, default=3)
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help='fraction of the points moved every frame')
+    parser.add_argument('--locality', type=float, default=1.0,
+                        help='fraction of the moved points taken from one local region')
+    parser.add_argument('--csv-rows', type=int, default=100_000)
+    parser.add_argument('--csv-columns', type=int, default=8)
+    parser.add_argument(
+        '--benches',
+        nargs='+',
+        default=['csv', 'ply-sender', 'ply-loader'],
+        choices=['csv', 'ply-sender', 'ply-loader'])
+    parser.add_argument('-o', '--output', default=None,
+                        help='write results as JSON (default: stdout)')
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        run_case(json.loads(args.case))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if 'csv' in args.benches:
+            for mode in ['row', 'batch']:
+                results.append(bench_csv(
+                    tmpdir, args.csv_rows, args.csv_columns, mode))
+                print(results[-1], file=sys.stderr)
+        for num_points in args.num_points:
+            if 'ply-sender' in args.benches:
+                for splitting_method in args.splitting_methods:
+                    for diff in args.diff_modes:
+                        results.append(spawn_case({
+                            'bench': 'ply-sender',
+                            'num_points': num_points,
+                            'splitting_method': splitting_method,
+                            'diff': diff,
+                            'encoding': args.encoding,
+                            'frames': args.frames,
+                            'churn': args.churn,
+                            'locality': args.locality,
+                            'rrd_path': os.path.join(tmpdir, 'ply.rrd'),
+                        }))
+                        print(results[-1], file=sys.stderr)
+            if 'ply-loader' in args.benches:
+                ply_path = os.path.join(tmpdir, 'bench.ply')
+                write_binary_ply(ply_path, num_points)
+                for loader in ['memmap', 'trimesh']:
+                    results.append(spawn_case({
+                        'bench': 'ply-loader',
+                        'num_points': num_points,
+                        'loader': loader,
+                        'ply_path': ply_path,
+                    }))
+                    print(results[-1], file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,575 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
 import csv
+import io
 import numpy as np
+import os
+import queue
+import selectors
 import sys
+import threading
 import time
 
 import rerun as rr
 
+import rate_control
+import rerun_sender
+import rrd_tools
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+PARSERS = ['auto', 'csv', 'numpy', 'pyarrow']
+AGGREGATE_METHODS = ['raw', 'min', 'max', 'mean', 'lttb']
+
+
+def read_header(raw):
+    line = raw.readline().decode()
+    return next(csv.reader([line]))
+
+
+def rows_to_table(rows):
+    # NOTE: empty fields are NaN, like the pyarrow backend
+    table = np.array(rows)
+    return np.where(table == '', 'nan', table).astype(np.float64)
+
+
+def loadtxt(data):
+    try:
+        return np.loadtxt(io.BytesIO(data), delimiter=',', dtype=np.float64,
+                          ndmin=2)
+    except ValueError:
+        # slow path only for chunks with empty fields
+        return np.atleast_2d(np.genfromtxt(
+            io.BytesIO(data), delimiter=',', dtype=np.float64))
+
+
+def iter_chunks_csv(raw, header, chunk_rows, chunk_bytes):
+    reader = csv.reader(io.TextIOWrapper(raw, newline=''))
+    rows = []
+    for row in reader:
+        if len(row) == 0:
+            continue
+        rows.append(row)
+        if len(rows) >= chunk_rows:
+            yield rows_to_table(rows)
+            rows = []
+    if rows:
+        yield rows_to_table(rows)
+
+
+def iter_chunks_numpy(raw, header, chunk_rows, chunk_bytes):
+    # NOTE: read1 returns as soon as some bytes are available, so live pipes are not delayed
+    read = getattr(raw, 'read1', raw.read)
+    rest = b''
+    while True:
+        data = read(chunk_bytes)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            rest = data
+            continue
+        rest = data[end:]
+        if data[:end].strip():
+            yield loadtxt(data[:end])
+    if rest.strip():
+        yield loadtxt(rest)
+
+
+def iter_chunks_pyarrow(raw, header, chunk_rows, chunk_bytes):
+    reader = pa_csv.open_csv(
+        raw,
+        read_options=pa_csv.ReadOptions(
+            column_names=header, block_size=chunk_bytes),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.float64() for name in header}),
+    )
+    for batch in reader:
+        if batch.num_rows == 0:
+            continue
+        yield np.column_stack([column.to_numpy(zero_copy_only=False)
+                               for column in batch.columns])
+
+
+def select_parser(parser):
+    if parser == 'auto':
+        parser = 'pyarrow' if pa_csv is not None else 'numpy'
+    if parser == 'pyarrow' and pa_csv is None:
+        print('[WARN] pyarrow is not installed, fallback to numpy parser')
+        parser = 'numpy'
+    return {
+        'csv': iter_chunks_csv,
+        'numpy': iter_chunks_numpy,
+        'pyarrow': iter_chunks_pyarrow,
+    }[parser]
+
+
+class WindowAggregator:
+
+    def __init__(self, window, methods):
+        self.window = window
+        self.methods = [m for m in methods if m in ('min', 'max', 'mean')]
+        self.rest_steps = np.zeros(0, dtype=np.int64)
+        self.rest_values = np.zeros(0, dtype=np.float64)
+
+    def push(self, steps, values, flush=False):
+        steps = np.concatenate((self.rest_steps, steps))
+        values = np.concatenate((self.rest_values, values))
+        n = len(values) if flush else len(values) // self.window * self.window
+        self.rest_steps = steps[n:]
+        self.rest_values = values[n:]
+        if n == 0:
+            return []
+        # NOTE: a window is labeled with its last step, a flushed partial
+        # window is reduced over its own rows only
+        starts = np.arange(0, n, self.window)
+        ends = np.minimum(starts + self.window, n)
+        window_steps = steps[ends - 1]
+        outputs = []
+        for method in self.methods:
+            if method == 'min':
+                outputs.append((method, window_steps,
+                                np.minimum.reduceat(values[:n], starts)))
+            elif method == 'max':
+                outputs.append((method, window_steps,
+                                np.maximum.reduceat(values[:n], starts)))
+            elif method == 'mean':
+                outputs.append((method, window_steps,
+                                np.add.reduceat(values[:n], starts) / (ends - starts)))
+        return outputs
+
+
+class LttbDecimator:
+    # NOTE: streaming Largest-Triangle-Three-Buckets, one point per bucket of window rows
+
+    def __init__(self, window):
+        self.window = window
+        self.rest_steps = np.zeros(0, dtype=np.int64)
+        self.rest_values = np.zeros(0, dtype=np.float64)
+        self.selected = None
+        self.bucket = None
+
+    def select(self, bucket, next_x, next_y):
+        ax, ay = self.selected
+        xs, ys = bucket
+        area = np.abs((ax - next_x) * (ys - ay) - (ax - xs) * (next_y - ay))
+        index = int(np.argmax(area))
+        self.selected = (xs[index], ys[index])
+        return self.selected
+
+    def push(self, steps, values, flush=False):
+        steps = np.concatenate((self.rest_steps, steps))
+        values = np.concatenate((self.rest_values, values))
+        n = len(values) if flush else len(values) // self.window * self.window
+        self.rest_steps = steps[n:]
+        self.rest_values = values[n:]
+        out_steps = []
+        out_values = []
+        for begin in range(0, n, self.window):
+            xs = steps[begin:begin + self.window]
+            ys = values[begin:begin + self.window]
+            if self.selected is None:
+                self.selected = (xs[0], ys[0])
+                out_steps.append(xs[0])
+                out_values.append(ys[0])
+                xs = xs[1:]
+                ys = ys[1:]
+                if len(xs) == 0:
+                    continue
+            if self.bucket is not None:
+                x, y = self.select(self.bucket, xs.mean(), ys.mean())
+                out_steps.append(x)
+                out_values.append(y)
+            self.bucket = (xs, ys)
+        if flush and self.bucket is not None:
+            # the last point is always kept
+            xs, ys = self.bucket
+            x, y = self.select((xs[:-1], ys[:-1]), xs[-1], ys[-1]) if len(
+                xs) > 1 else (xs[-1], ys[-1])
+            out_steps += [x, xs[-1]] if len(xs) > 1 else [x]
+            out_values += [y, ys[-1]] if len(ys) > 1 else [y]
+            self.bucket = None
+        if len(out_steps) == 0:
+            return []
+        return [('lttb', np.array(out_steps, dtype=np.int64),
+                 np.array(out_values, dtype=np.float64))]
+
+
+class SeriesAggregator:
+
+    def __init__(self, window, methods):
+        self.raw = 'raw' in methods
+        self.stages = []
+        if any(m in ('min', 'max', 'mean') for m in methods):
+            self.stages.append(WindowAggregator(window, methods))
+        if 'lttb' in methods:
+            self.stages.append(LttbDecimator(window))
+
+    def push(self, steps, values, flush=False):
+        outputs = [(None, steps, values)] if self.raw and len(values) else []
+        for stage in self.stages:
+            outputs += stage.push(steps, values, flush)
+        return outputs
+
+
+def parse_aggregate_specs(specs, header):
+    # NOTE: 'col=min,max' for one column, 'min,max' for every column without its own spec
+    default_methods = None
+    column_methods = {}
+    for spec in specs:
+        if '=' in spec:
+            column_name, methods = spec.split('=', 1)
+            if column_name not in header[1:]:
+                print(f"[WARN] unknown column '{column_name}' in --aggregate")
+                continue
+            column_methods[header.index(column_name)] = methods.split(',')
+        else:
+            default_methods = spec.split(',')
+    for methods in [default_methods] + list(column_methods.values()):
+        for method in methods or []:
+            if method not in AGGREGATE_METHODS:
+                raise ValueError(f"invalid aggregate method '{method}'")
+    if default_methods is not None:
+        for i in range(1, len(header)):
+            column_methods.setdefault(i, default_methods)
+    return column_methods
+
+
+def send_series(entity, steps, values):
+    rerun_sender.send_columns(
+        entity,
+        times=[rr.TimeSequenceColumn("step", steps)],
+        components=[rr.components.ScalarBatch(values)],
+    )
+
+
+def send_columns(title, header, table, aggregators=None, flush=False):
+    steps = table[:, 0].astype(np.int64)
+    for i, column_name in enumerate(header[1:], 1):
+        entity = "{}/{}".format(title, column_name)
+        if aggregators is None or i not in aggregators:
+            if len(steps):
+                send_series(entity, steps, table[:, i])
+            continue
+        for method, series_steps, values in aggregators[i].push(
+                steps, table[:, i], flush):
+            series_entity = entity if method is None else "{}/{}".format(
+                entity, method)
+            send_series(series_entity, series_steps, values)
+
+
+def log_batches(chunks, header, title, batch_rows, batch_sec,
+                aggregators=None):
+    # NOTE: flush on row count or on batch_sec after the first pending row
+    # arrived, whichever comes first; the deadline does not wait for the next chunk
+    chunk_queue = start_reader(chunks)
+    total_rows = 0
+    start = time.perf_counter()
+    pending = []
+    pending_rows = 0
+    batch_start = None
+
+    def flush():
+        table = np.concatenate(pending)
+        for offset in range(0, len(table), batch_rows):
+            send_columns(title, header, table[offset:offset + batch_rows],
+                         aggregators)
+        return len(table)
+
+    while True:
+        timeout = None
+        if pending:
+            timeout = max(batch_start + batch_sec - time.monotonic(), 0.0)
+        try:
+            item = chunk_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = ()
+        if isinstance(item, Exception):
+            raise item
+        if item is None:
+            break
+        if item:
+            arrival, table = item
+            if not pending:
+                batch_start = arrival
+            pending.append(table)
+            pending_rows += len(table)
+        if pending and (pending_rows >= batch_rows or
+                        time.monotonic() - batch_start >= batch_sec):
+            total_rows += flush()
+            pending = []
+            pending_rows = 0
+    if pending:
+        total_rows += flush()
+    if aggregators:
+        send_columns(title, header, np.zeros((0, len(header))),
+                     aggregators, flush=True)
+    elapsed = time.perf_counter() - start
+    rows_per_sec = total_rows / elapsed if elapsed > 0 else float('inf')
+    print('sent {} rows in {:.3f}s ({:.1f} rows/sec)'.format(
+        total_rows, elapsed, rows_per_sec))
+
+
+def coalesce_rows(table, mode):
+    # NOTE: returns (row to send, rows left pending)
+    if mode == 'latest':
+        return (table[-1:], table[:0])
+    if mode == 'mean':
+        row = table.mean(axis=0, keepdims=True)
+        row[0, 0] = table[-1, 0]
+        return (row, table[:0])
+    return (table[:1], table[1:])
+
+
+def start_reader(chunks, maxsize=64):
+    chunk_queue = queue.Queue(maxsize)
+
+    def read():
+        # NOTE: always end with the sentinel, a parse error is passed to the caller
+        try:
+            for table in chunks:
+                chunk_queue.put((time.monotonic(), table))
+        except Exception as e:
+            chunk_queue.put(e)
+        finally:
+            chunk_queue.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    return chunk_queue
+
+
+def log_rows(chunks, header, title, controller, coalesce):
+    chunk_queue = start_reader(chunks)
+    # NOTE: (arrival, table) chunks, the first `offset` rows of the first one are already sent
+    pending = collections.deque()
+    pending_rows = 0
+    offset = 0
+    eof = False
+
+    def add(item):
+        nonlocal eof, pending_rows
+        if isinstance(item, Exception):
+            raise item
+        if item is None:
+            eof = True
+        else:
+            pending.append(item)
+            pending_rows += len(item[1])
+            controller.receive(len(item[1]))
+
+    while True:
+        if not pending and not eof:
+            add(chunk_queue.get())
+        while not eof:
+            try:
+                add(chunk_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not pending:
+            if eof:
+                break
+            continue
+        delay = controller.delay()
+        if delay > 0:
+            if eof:
+                time.sleep(delay)
+            else:
+                try:
+                    add(chunk_queue.get(timeout=delay))
+                except queue.Empty:
+                    pass
+            continue
+
+        arrival, table = pending[0]
+        if coalesce == 'none':
+            # one row at a time, the backlog is never copied
+            rows = table[offset:offset + 1]
+            offset += 1
+            if offset == len(table):
+                pending.popleft()
+                offset = 0
+            coalesced_rows = 0
+        else:
+            table = np.concatenate(
+                [table[offset:]] + [table for _, table in list(pending)[1:]])
+            rows, _ = coalesce_rows(table, coalesce)
+            pending.clear()
+            offset = 0
+            coalesced_rows = len(table) - len(rows)
+        pending_rows -= len(rows) + coalesced_rows
+        for row in rows:
+            step = int(row[0])
+            rerun_sender.set_time_sequence("step", step)
+            for i, column_name in enumerate(header[1:], 1):
+                print('{}[{}]={}'.format(column_name, step, row[i]))
+                rerun_sender.log("{}/{}".format(title, column_name),
+                                 rr.Scalar(row[i]))
+        controller.consume(len(rows), rows.nbytes, coalesced_rows)
+        controller.report(pending_rows, time.monotonic() - arrival)
+    controller.report(force=True)
+
+
+def log_series_style(entity, name, color, marker_size):
+    rerun_sender.log(
+        entity,
+        rr.SeriesLine(
+            color=color,
+            name="{}".format(name),
+        ),
+        timeless=True,
+    )
+    rerun_sender.log(
+        entity,
+        rr.SeriesPoint(
+            color=color,
+            name="{}".format(name),
+            marker="circle",
+            marker_size=marker_size,
+        ),
+        timeless=True,
+    )
+
+
+def log_styles(title, header, aggregate_methods, marker_size, rng):
+    for i, column_name in enumerate(header[1:], 1):
+        color = list(rng.choice(range(256), size=3))
+        print('{} color is: {}'.format(column_name, color))
+        entity = "{}/{}".format(title, column_name)
+        methods = aggregate_methods.get(i, ['raw'])
+        for method in methods:
+            if method == 'raw':
+                log_series_style(entity, column_name, color, marker_size)
+            else:
+                log_series_style(
+                    "{}/{}".format(entity, method),
+                    "{}/{}".format(column_name, method),
+                    color, marker_size)
+
+
+def parse_mux_spec(spec, default_title):
+    # NOTE: "title=path", "path" (title: file name) or "-" (stdin); the title
+    # ends at the first '=', so a path may contain '='
+    title, sep, path = spec.partition('=')
+    if not sep:
+        path = title
+        if path == '-':
+            title = default_title
+        else:
+            title = os.path.splitext(os.path.basename(path))[0]
+    return (title, path)
+
+
+class MuxStream:
+
+    def __init__(self, title, path, color_seed):
+        self.title = title
+        self.path = path
+        self.color_seed = color_seed
+        if path == '-':
+            self.fd = sys.stdin.buffer.fileno()
+        else:
+            # NOTE: a FIFO open blocks until a writer connects, so open it
+            # non-blocking; reads only happen after poll reports data
+            self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            os.set_blocking(self.fd, True)
+        self.header = None
+        self.aggregators = None
+        self.rest = b''
+        self.pending = []
+        self.pending_rows = 0
+        self.batch_start = time.perf_counter()
+        self.total_rows = 0
+
+    def feed(self, data, aggregate_specs, window_rows, marker_size):
+        data = self.rest + data
+        end = data.rfind(b'\n') + 1
+        self.rest = data[end:]
+        lines = data[:end]
+        if self.header is None:
+            if end == 0:
+                return
+            line, _, lines = lines.partition(b'\n')
+            self.header = next(csv.reader([line.decode()]))
+            print('[{}] header: {}'.format(self.title, self.header))
+            aggregate_methods = parse_aggregate_specs(
+                aggregate_specs, self.header)
+            log_styles(self.title, self.header, aggregate_methods,
+                       marker_size, np.random.RandomState(self.color_seed))
+            self.aggregators = {
+                i: SeriesAggregator(window_rows, methods)
+                for i, methods in aggregate_methods.items()}
+        if lines.strip():
+            table = loadtxt(lines)
+            self.pending.append(table)
+            self.pending_rows += len(table)
+
+    def flush(self, batch_rows, final=False):
+        if self.pending:
+            table = np.concatenate(self.pending)
+            for offset in range(0, len(table), batch_rows):
+                send_columns(self.title, self.header,
+                             table[offset:offset + batch_rows],
+                             self.aggregators)
+            self.total_rows += len(table)
+            self.pending = []
+            self.pending_rows = 0
+        if final and self.aggregators:
+            send_columns(self.title, self.header,
+                         np.zeros((0, len(self.header))),
+                         self.aggregators, flush=True)
+        self.batch_start = time.perf_counter()
+
+    def close(self, aggregate_specs, window_rows, marker_size, batch_rows):
+        if self.rest.strip():
+            self.feed(b'\n', aggregate_specs, window_rows, marker_size)
+        if self.header is not None:
+            self.flush(batch_rows, final=True)
+        if self.path != '-':
+            os.close(self.fd)
+
+
+def log_mux(specs, default_title, color_seed, marker_size, aggregate_specs,
+            window_rows, batch_rows, batch_sec, chunk_bytes):
+    # NOTE: one process and one connection for many inputs, each input is
+    # batched into columnar chunks under its own title
+    streams = [MuxStream(title, path, color_seed + i)
+               for i, (title, path) in enumerate(
+                   parse_mux_spec(spec, default_title) for spec in specs)]
+    # poll (unlike epoll) accepts regular files, they are always readable
+    selector = selectors.PollSelector()
+    for stream in streams:
+        selector.register(stream.fd, selectors.EVENT_READ, stream)
+    start = time.perf_counter()
+    while selector.get_map():
+        for key, _ in selector.select(batch_sec):
+            stream = key.data
+            data = os.read(stream.fd, chunk_bytes)
+            if not data:
+                selector.unregister(stream.fd)
+                stream.close(aggregate_specs, window_rows, marker_size,
+                             batch_rows)
+                print('[INFO] {} closed ({} rows)'.format(
+                    stream.title, stream.total_rows))
+                continue
+            stream.feed(data, aggregate_specs, window_rows, marker_size)
+        now = time.perf_counter()
+        for stream in streams:
+            if stream.pending_rows >= batch_rows or (
+                    stream.pending and now - stream.batch_start >= batch_sec):
+                stream.flush(batch_rows)
+    elapsed = time.perf_counter() - start
+    total_rows = sum(stream.total_rows for stream in streams)
+    print('sent {} rows from {} inputs in {:.3f}s'.format(
+        total_rows, len(streams), elapsed))
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -18,13 +580,87 @@ def main():
     parser.add_argument('-t', '--title', default='no_graph_name')
     parser.add_argument('-c', '--color-seed', default=0)
     parser.add_argument('--recording_id', default=None)
+    parser.add_argument(
+        '--save',
+        default=None,
+        help='write the recording to this .rrd file instead of streaming it (no --interval sleep)')
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='compact the --save file into large chunks at exit')
     parser.add_argument('--marker_size', default=2)
-    parser.add_argument('--interval', type=float, default=0.1)
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=0.1,
+        help='row interval, used as --rate-rows=1/interval when --rate-rows is not set')
+    parser.add_argument(
+        '--rate-rows',
+        type=float,
+        default=None,
+        help='target rows/sec (0: unlimited)')
+    parser.add_argument(
+        '--rate-bytes',
+        type=float,
+        default=0.0,
+        help='target bytes/sec (0: unlimited)')
+    parser.add_argument(
+        '--coalesce',
+        default='none',
+        choices=['none', 'latest', 'mean'],
+        help='when behind the target rate, send every row (none), only the latest row or the mean of the backlog')
+    parser.add_argument(
+        '--report-sec',
+        type=float,
+        default=5.0,
+        help='interval of throughput and lag report (0: only at exit)')
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='send rows as columnar chunks (disables --interval and per-value print)')
+    parser.add_argument(
+        '--batch-rows',
+        type=int,
+        default=1000,
+        help='max rows per chunk for --batch')
+    parser.add_argument(
+        '--batch-ms',
+        type=float,
+        default=100.0,
+        help='max milliseconds to gather rows per chunk for --batch')
+    parser.add_argument(
+        '--aggregate',
+        action='append',
+        default=[],
+        help='per column aggregation for --batch, e.g. "a=min,max" or "min,max,mean" for all columns ({})'.format(
+            ','.join(AGGREGATE_METHODS)))
+    parser.add_argument(
+        '--window-rows',
+        type=int,
+        default=10,
+        help='rows per aggregation window (or lttb bucket)')
+    parser.add_argument(
+        '--parser',
+        default=None,
+        choices=PARSERS,
+        help='csv parsing backend (default: csv, or numpy with --batch)')
+    parser.add_argument(
+        '--chunk-bytes',
+        type=int,
+        default=1 << 20,
+        help='bytes read at once by numpy/pyarrow parser')
     parser.add_argument(
         '-i',
         '--input-filepath',
-        type=argparse.FileType(),
-        default=sys.stdin)
+        type=argparse.FileType('rb'),
+        default=sys.stdin.buffer)
+    parser.add_argument(
+        '-m',
+        '--mux',
+        action='append',
+        default=[],
+        help='read many inputs in one process, "title=path" or "path" (file, FIFO or - for stdin), sent as --batch chunks')
+    rerun_sender.add_queue_arguments(parser)
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('args', nargs='*')
 
@@ -38,49 +674,65 @@ def main():
     recording_id = args.recording_id
     interval = args.interval
     input_filepath = args.input_filepath
+    parser_name = args.parser
+    if parser_name is None:
+        # NOTE: numpy reads with read1, so a live pipe is not held back until
+        # a full chunk (pyarrow) or --batch-rows rows (csv) have arrived
+        parser_name = 'numpy' if args.batch else 'csv'
+    iter_chunks = select_parser(parser_name)
 
-    np.random.seed(seed=seed)
-    with input_filepath as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        print('header:', header)
-
-        rr.init(
-            "{}".format(app_title),
-            recording_id=recording_id,
-            spawn=spawn)
-        if not spawn:
-            rr.connect(addr=addr)
-
-        for column_name in header[1:]:
-            color = list(np.random.choice(range(256), size=3))
-            print('{} color is: {}'.format(column_name, color))
-            rr.log(
-                "{}/{}".format(title, column_name),
-                rr.SeriesLine(
-                    color=color,
-                    name="{}".format(column_name),
-                ),
-                timeless=True,
-            )
-            rr.log(
-                "{}/{}".format(title, column_name),
-                rr.SeriesPoint(
-                    color=color,
-                    name="{}".format(column_name),
-                    marker="circle",
-                    marker_size=marker_size,
-                ),
-                timeless=True,
-            )
-
-        for _, row in enumerate(reader):
-            step = int(row[0])
-            rr.set_time_sequence("step", step)
-            for i, column_name in enumerate(header[1:], 1):
-                print('{}[{}]={}'.format(column_name, step, row[i]))
-                rr.log("{}/{}".format(title, column_name), rr.Scalar(row[i]))
-            time.sleep(interval)
+    if args.save:
+        interval = 0
+    rerun_sender.init(
+        "{}".format(app_title),
+        recording_id=recording_id,
+        spawn=spawn,
+        addr=addr,
+        save=args.save,
+        queue_size=args.queue_size,
+        queue_policy=args.queue_policy,
+        report_sec=args.report_sec,
+        label='{}/queue'.format(title))
+
+    if args.mux:
+        log_mux(args.mux, title, int(seed), marker_size, args.aggregate,
+                args.window_rows, args.batch_rows, args.batch_ms / 1000.0,
+                args.chunk_bytes)
+    else:
+        np.random.seed(seed=seed)
+        with input_filepath as f:
+            header = read_header(f)
+            print('header:', header)
+
+            aggregate_methods = parse_aggregate_specs(args.aggregate, header)
+            log_styles(title, header, aggregate_methods, marker_size,
+                       np.random)
+
+            if args.batch:
+                chunks = iter_chunks(
+                    f, header, args.batch_rows, args.chunk_bytes)
+                aggregators = {
+                    i: SeriesAggregator(args.window_rows, methods)
+                    for i, methods in aggregate_methods.items()}
+                log_batches(chunks, header, title, args.batch_rows,
+                            args.batch_ms / 1000.0, aggregators)
+            else:
+                if aggregate_methods:
+                    print('[WARN] --aggregate is used only with --batch')
+                rows_per_sec = args.rate_rows
+                if rows_per_sec is None:
+                    rows_per_sec = rate_control.interval_to_rate(interval)
+                controller = rate_control.RateController(
+                    rows_per_sec, args.rate_bytes,
+                    report_sec=args.report_sec, label=title)
+                chunks = iter_chunks(f, header, 1, args.chunk_bytes)
+                log_rows(chunks, header, title, controller, args.coalesce)
+
+    rerun_sender.shutdown()
+    if args.save:
+        if args.compact:
+            rrd_tools.compact_rrd([args.save], args.save)
+            print('[INFO] compacted', args.save)
 
 
 if __name__ == "__main__":
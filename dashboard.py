@@ -2,8 +2,11 @@
 
 import asyncio
 
+import rerun as rr
 import streamlit as st
 
+import metrics_collector
+
 st.set_page_config(
     page_title="Streamlit Dashboard App",
     layout="wide",
@@ -47,41 +50,33 @@ async def rerun_app(container):
         if st.button("▶️ Run rerun sample"):
             rerun_button_flag = True
         st.write('memory and cpu samples')
+        sample_hz = st.number_input(
+            "sample rate [Hz]", min_value=0.1, max_value=1000.0, value=10.0)
 
     async def rerun():
+        recording_id = f'record-{st.session_state.count}'
+        # NOTE: connect() of any recording is ignored until the SDK is
+        # enabled by rr.init, the collector logs to its own recordings
+        rr.init("no_app_name", spawn=False)
+
+        def new_recording(epoch):
+            recording = rr.new_recording(
+                "no_app_name", recording_id=f'{recording_id}-{epoch}')
+            rr.connect(addr='127.0.0.1:9876', recording=recording)
+            return recording
+
+        # NOTE: keep the last hour (at most) in a fresh recording every hour
+        collector = metrics_collector.MetricsCollector(
+            new_recording(0), sample_hz=sample_hz,
+            retention_samples=int(sample_hz * 3600), retention_sec=3600.0,
+            new_recording=new_recording)
         try:
-            recording_id = f'record-{st.session_state.count}'
-
-            def generate_shell_script(main_script):
-                return f'''
-                cleanup() {{
-                  exit_code=$?
-                  pkill -P $$
-                  exit $exit_code
-                }}
-                trap cleanup INT TERM
-                {main_script}
-                BACKGROUND_PID=$!
-                wait $BACKGROUND_PID
-                trap - INT TERM
-                '''
-            command1 = generate_shell_script(f'''
-            python3 -c $'import psutil; import time;\nprint("id,",",".join(map(str,range(psutil.cpu_count(logical=False)))));\ni=0\nwhile True: print(i,",",",".join(map(str,psutil.cpu_percent(percpu=True))), flush=True); time.sleep(0.1); i+=1' \
-                | ./csv-pipe-rerun.py --recording_id {recording_id} -t cpu --addr 127.0.0.1:9876 \
-                &
-            ''')
-            command2 = generate_shell_script(f'''
-            python3 -c $'import psutil; import time;\nprint("id,used,free");\ni=0\nwhile True: memory_info = psutil.virtual_memory(); memory_used = memory_info.used / (1024 ** 2); memory_free = memory_info.free / (1024 ** 2); print(i, ",", memory_used, ",", memory_free, flush=True); time.sleep(0.1); i+=1' \
-              | ./csv-pipe-rerun.py --recording_id {recording_id} -t memory --addr 127.0.0.1:9876 \
-              &
-            ''')
             inner_container.write("running...")
-            result1, result2 = await asyncio.gather(run_command_async(command1), run_command_async(command2))
-            inner_container.write("asyncio result:")
-            inner_container.code(result1, language="bash")
-            inner_container.code(result2, language="bash")
+            await collector.run()
         except asyncio.CancelledError as e:
             raise e
+        finally:
+            rr.disconnect(recording=collector.recording)
 
     tasks = []
     if rerun_button_flag is True:
@@ -0,0 +1,104 @@
+import asyncio
+
+import numpy as np
+import psutil
+import rerun as rr
+from rerun.recording_stream import RecordingStream
+
+import retention
+
+
+class MetricsCollector:
+
+    def __init__(self, recording=None, sample_hz=10.0, color_seed=0,
+                 marker_size=2, retention_samples=0, retention_sec=0.0,
+                 new_recording=None):
+        # NOTE: new_recording(epoch) returns a connected recording, it is used
+        # to re-publish the retained window every retention_sec
+        self.recording = recording
+        self.new_recording = new_recording
+        self.retained = retention.RetentionWindow(
+            retention_samples if new_recording else 0, retention_sec)
+        self.sample_hz = sample_hz
+        self.color_seed = color_seed
+        self.marker_size = marker_size
+        self.step = 0
+        self.styled = set()
+        self.rng = np.random.RandomState(color_seed)
+        self.colors = {}
+
+    def sample(self):
+        # NOTE: one psutil call per metric group and tick
+        values = {}
+        for i, percent in enumerate(psutil.cpu_percent(percpu=True)):
+            values['cpu/{}'.format(i)] = percent
+        memory_info = psutil.virtual_memory()
+        values['memory/used'] = memory_info.used / (1024 ** 2)  # MB
+        values['memory/free'] = memory_info.free / (1024 ** 2)  # MB
+        return values
+
+    def log_style(self, entity):
+        if entity not in self.colors:
+            self.colors[entity] = list(self.rng.choice(range(256), size=3))
+        color = self.colors[entity]
+        name = entity.rsplit('/', 1)[-1]
+        rr.log(
+            entity,
+            rr.SeriesLine(color=color, name=name),
+            timeless=True,
+            recording=self.recording,
+        )
+        rr.log(
+            entity,
+            rr.SeriesPoint(
+                color=color,
+                name=name,
+                marker="circle",
+                marker_size=self.marker_size,
+            ),
+            timeless=True,
+            recording=self.recording,
+        )
+        self.styled.add(entity)
+
+    def log(self, values):
+        rr.set_time_sequence("step", self.step, recording=self.recording)
+        for entity, value in values.items():
+            if entity not in self.styled:
+                self.log_style(entity)
+            rr.log(entity, rr.Scalar(value), recording=self.recording)
+            self.retained.append(entity, self.step, value)
+        self.step += 1
+
+    def republish(self):
+        windows = list(self.retained.windows())
+        old_recording = self.recording
+        self.recording = self.new_recording(self.retained.epoch)
+        self.styled = set()
+        for entity, steps, values in windows:
+            self.log_style(entity)
+            rr.send_columns(
+                entity,
+                times=[rr.TimeSequenceColumn("step", steps)],
+                components=[rr.components.ScalarBatch(values)],
+                # NOTE: send_columns of rerun 0.18 only accepts the native stream
+                recording=RecordingStream.to_native(self.recording),
+            )
+        rr.disconnect(recording=old_recording)
+
+    async def run(self):
+        # NOTE: schedule ticks on absolute deadlines so sampling time does not add to the period
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.sample_hz
+        deadline = loop.time()
+        while True:
+            self.log(self.sample())
+            if self.retained.due():
+                self.republish()
+            deadline += period
+            delay = deadline - loop.time()
+            if delay < 0:
+                # behind: skip missed ticks instead of bursting
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
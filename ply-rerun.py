@@ -2,86 +2,135 @@
 
 import numpy as np
 import quaternion
-import math
-import time
 import rerun as rr
+import rerun.blueprint as rrb
+from rerun.blueprint.archetypes import VisibleTimeRanges
 import trimesh
 import numpy as np
 
+import ply_reader
+import rate_control
+import rerun_sender
 
-def generate_dummy_data():
+
+def generate_dummy_data(batch_size=10):
+    # NOTE: yields batches of poses, the rotation increment is constant so the
+    # k-th orientation is q0 * increment^k (exp/log of the whole batch at once)
     sequential_id = 0
     angular_velocity = np.array([0.1, 0.2, 0.3])
     dt = 0.1
     q = quaternion.from_euler_angles([0, 0, 0])
+    rotation_increment = quaternion.from_euler_angles(angular_velocity * dt)
+    log_increment = np.log(rotation_increment)
+    direction = np.array([0.0, 0.0, 1.0])
+    distance = 1.0
+    steps = np.arange(1, batch_size + 1)
     while True:
-        sequential_id += 1
-        # quaternion_vec = np.quaternion(0.707, 0, 0.707, 0)
-
-        x = (sequential_id - 30) * 0.1
-        y = math.sin(x)
-        z = math.cos(3 * x)
-        rotation_increment = quaternion.from_euler_angles(
-            angular_velocity * dt)
-        q *= rotation_increment
-
-        original_position = np.array([x, y, z])
-        direction = np.array([0.0, 0.0, 1.0])
-        rotated_direction = quaternion.rotate_vectors(q, direction)
-        distance = 1.0
-        rotated_vector = rotated_direction * distance
-        yield (original_position, rotated_vector)
-
-
-rr.init("PLY Point Cloud Viewer", spawn=True)
-
-
-def create_viewcone(label, origin, quat, color):
-    lines = [
-        [
-            [-0.5, -0.5, 0],
-            [0.5, -0.5, 0],
-            [0.5, 0.5, 0],
-            [-0.5, 0.5, 0],
-            [-0.5, -0.5, 0],
-        ],
-        [
-            [-0.5, -0.5, 0],
-            [0.0, 0.0, 1.44 / 2],
-        ],
-        [
-            [0.5, -0.5, 0],
-            [0.0, 0.0, 1.44 / 2],
-        ],
-        [
-            [-0.5, 0.5, 0],
-            [0.0, 0.0, 1.44 / 2],
-        ],
-        [
-            [0.5, 0.5, 0],
-            [0.0, 0.0, 1.44 / 2],
-        ],
-    ]
-    rr.log(
-        label,
-        rr.LineStrips3D(
-            lines,
-            colors=[color] * len(lines),
-            radii=[[0.025]] * len(lines),
-            # labels=["one strip here", "and one strip there"],
-        )
-    )
-    rr.log(
-        label,
-        rr.Transform3D(
-            translation=origin,
-            mat3x3=quaternion.as_rotation_matrix(quat)
-        )
-    )
+        ids = sequential_id + steps
+        sequential_id += batch_size
+
+        x = (ids - 30) * 0.1
+        positions = np.column_stack((x, np.sin(x), np.cos(3 * x)))
+        quats = q * np.exp(log_increment * steps)
+        q = quats[-1]
+
+        rotated_vectors = quaternion.rotate_vectors(quats, direction) * distance
+        yield (positions, rotated_vectors)
+
+
+# NOTE: a slow viewer coalesces pending point clouds instead of stalling the loader
+rerun_sender.init("PLY Point Cloud Viewer", spawn=True,
+                  queue_size=16, queue_policy='coalesce')
+# each frame logs only its own arrows, the viewer shows all the steps up to the
+# time cursor as the trail
+rr.send_blueprint(rrb.Blueprint(rrb.Spatial3DView(
+    origin="/",
+    overrides={
+        "arrows-from-data": VisibleTimeRanges(rrb.VisibleTimeRange(
+            "step",
+            start=rrb.TimeRangeBoundary.infinite(),
+            end=rrb.TimeRangeBoundary.cursor_relative())),
+    })))
+
+
+VIEWCONE_STRIPS = [
+    [
+        [-0.5, -0.5, 0],
+        [0.5, -0.5, 0],
+        [0.5, 0.5, 0],
+        [-0.5, 0.5, 0],
+        [-0.5, -0.5, 0],
+    ],
+    [
+        [-0.5, -0.5, 0],
+        [0.0, 0.0, 1.44 / 2],
+    ],
+    [
+        [0.5, -0.5, 0],
+        [0.0, 0.0, 1.44 / 2],
+    ],
+    [
+        [-0.5, 0.5, 0],
+        [0.0, 0.0, 1.44 / 2],
+    ],
+    [
+        [0.5, 0.5, 0],
+        [0.0, 0.0, 1.44 / 2],
+    ],
+]
+
+
+class ViewconeCache:
+
+    def __init__(self, label, color, radius=0.025):
+        self.label = label
+        self.color = color
+        self.radius = radius
+        self.origins = []
+        self.rotations = []
+
+    def log(self, origins, quats):
+        # NOTE: one entity per camera, the strips never change so they are logged
+        # once as timeless, and a camera sends its Transform3D only when it moved
+        origins = np.asarray(origins, dtype=np.float32)
+        rotations = quaternion.as_rotation_matrix(quats).astype(np.float32)
+        moved = 0
+        for i, (origin, rotation) in enumerate(zip(origins, rotations)):
+            label = '{}/{}'.format(self.label, i)
+            if i == len(self.origins):
+                rerun_sender.log(
+                    label,
+                    rr.LineStrips3D(
+                        VIEWCONE_STRIPS,
+                        colors=self.color,
+                        radii=self.radius,
+                    ),
+                    timeless=True,
+                )
+                self.origins.append(None)
+                self.rotations.append(None)
+            elif np.array_equal(origin, self.origins[i]) and np.array_equal(
+                    rotation, self.rotations[i]):
+                continue
+            # sent only when the camera moved, so it must not be dropped
+            rerun_sender.log(
+                label,
+                rr.Transform3D(
+                    translation=origin,
+                    mat3x3=rotation
+                ),
+                droppable=False,
+            )
+            self.origins[i] = origin
+            self.rotations[i] = rotation
+            moved += 1
+        return moved
 
 
 def load_and_log_ply(file_path):
-    point_cloud = trimesh.load(file_path)
+    point_cloud = ply_reader.read_binary_ply(file_path)
+    if point_cloud is None:
+        point_cloud = trimesh.load(file_path)
 
     positions = point_cloud.vertices
 
@@ -93,15 +142,7 @@ def load_and_log_ply(file_path):
 
     radii = np.full(positions.shape[0], 0.01)
 
-    for i in range(0, 10):
-        origin = [i * 0.1, i * 0.2, 1]
-        angle = math.radians(i * 20)
-        q = quaternion.from_euler_angles([0, -angle, 0])
-        label = 'viewcone/{}'.format(i)
-        color = [255, 0, 0]
-        create_viewcone(label, origin, q, color)
-
-    rr.log(
+    rerun_sender.log(
         "PLY Point Cloud",
         rr.Points3D(
             positions=positions,
@@ -116,20 +157,37 @@ ply_files = [
     'ply-data/fragment_002.ply',
 ]
 
-dummy_data_generator = generate_dummy_data()
+n = 10
+indices = np.arange(n)
+viewcone_origins = np.column_stack((indices * 0.1, indices * 0.2, np.ones(n)))
+angles = np.radians(indices * 20)
+viewcone_quats = quaternion.from_euler_angles(
+    np.column_stack((np.zeros(n), -angles, np.zeros(n))))
+viewcone_cache = ViewconeCache('viewcone', [255, 0, 0])
+dummy_data_generator = generate_dummy_data(n)
+# NOTE: one file per second, the time spent loading and logging counts toward it
+rate_controller = rate_control.RateController(
+    rows_per_sec=1.0, report_sec=0, label='ply')
 for ply_index, ply_file in enumerate(ply_files):
-    rr.set_time_sequence("step", ply_index)
+    rate_controller.wait()
+    rerun_sender.set_time_sequence("step", ply_index)
 
     load_and_log_ply(ply_file)
-    n = 10
-    for i in range(0, n):
-        (o, v) = next(dummy_data_generator)
-        # print(o, v)
-        rr.log(
-            "arrows-from-data/{}-{}".format(ply_index, i),
-            rr.Arrows3D(
-                origins=[o],
-                vectors=[v],
-                colors=[[1.0 * (i + ply_index * n) / (len(ply_files) * n), 0, 0.5, 0.5]]))
-
-    time.sleep(1)
+    viewcone_cache.log(viewcone_origins, viewcone_quats)
+    (origins, vectors) = next(dummy_data_generator)
+    colors = np.zeros((n, 4))
+    colors[:, 0] = (np.arange(n) + ply_index * n) / (len(ply_files) * n)
+    colors[:, 2:] = 0.5
+    # NOTE: one fixed entity, the blueprint keeps the earlier frames visible,
+    # so a frame of the trail must not be dropped
+    rerun_sender.log(
+        "arrows-from-data",
+        rr.Arrows3D(
+            origins=origins,
+            vectors=vectors,
+            colors=colors),
+        droppable=False)
+
+    rate_controller.consume(1, 0)
+rate_controller.report(force=True)
+rerun_sender.shutdown()
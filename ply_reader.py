@@ -0,0 +1,101 @@
+import numpy as np
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8',
+}
+PLY_BYTE_ORDERS = {
+    'binary_little_endian': '<',
+    'binary_big_endian': '>',
+}
+
+
+class PlyVisual:
+
+    def __init__(self, vertex_colors):
+        self.vertex_colors = vertex_colors
+
+
+class PlyPointCloud:
+
+    def __init__(self, vertices, colors=None):
+        self.vertices = vertices
+        if colors is not None:
+            self.visual = PlyVisual(colors)
+
+
+def read_ply_header(f):
+    line = f.readline()
+    if line.strip() != b'ply':
+        return None
+    byte_order = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line:
+            return None
+        words = line.decode('ascii', errors='replace').split()
+        if len(words) == 0 or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'end_header':
+            break
+        if words[0] == 'format':
+            byte_order = PLY_BYTE_ORDERS.get(words[1])
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property' and elements:
+            elements[-1][2].append(words[1:])
+    return (byte_order, elements, f.tell())
+
+
+def group_fields(properties, byte_order):
+    # NOTE: merge x/y/z and red/green/blue(/alpha) into subarray fields to get (n, 3) views
+    fields = []
+    names = [prop[-1] for prop in properties]
+    i = 0
+    while i < len(properties):
+        prop = properties[i]
+        if prop[0] == 'list' or prop[0] not in PLY_TYPES:
+            return None
+        dtype = byte_order + PLY_TYPES[prop[0]]
+        for name, group in (('xyz', ['x', 'y', 'z', None]),
+                            ('rgb', ['red', 'green', 'blue', 'alpha'])):
+            n = 4 if names[i:i + 4] == group else 3
+            if names[i:i + 3] == group[:3] and all(
+                    p[0] == prop[0] for p in properties[i:i + n]):
+                fields.append((name, dtype, (n,)))
+                i += n
+                break
+        else:
+            fields.append((prop[-1], dtype))
+            i += 1
+    return np.dtype(fields)
+
+
+def read_binary_ply(filepath):
+    # NOTE: return None for layouts this fast path does not support (ascii, lists, ...)
+    with open(filepath, 'rb') as f:
+        header = read_ply_header(f)
+    if header is None:
+        return None
+    byte_order, elements, data_offset = header
+    if byte_order is None or not elements or elements[0][0] != 'vertex':
+        return None
+    _, count, properties = elements[0]
+    dtype = group_fields(properties, byte_order)
+    if dtype is None or 'xyz' not in dtype.names:
+        return None
+    if count == 0:
+        vertex = np.zeros(0, dtype=dtype)
+    else:
+        vertex = np.memmap(filepath, dtype=dtype, mode='r',
+                           offset=data_offset, shape=(count,))
+    colors = vertex['rgb'] if 'rgb' in dtype.names else None
+    return PlyPointCloud(vertex['xyz'], colors)
+
@@ -0,0 +1,100 @@
+import time
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        # NOTE: rate <= 0 means unlimited
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate * 0.1, 1.0)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, amount=1.0):
+        # NOTE: an item waits until its tokens are there (at most capacity, a larger
+        # item goes through with a full bucket and leaves a debt to pay off)
+        if self.rate <= 0:
+            return 0.0
+        self.refill()
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, amount=1.0):
+        if self.rate <= 0:
+            return
+        self.refill()
+        self.tokens -= amount
+
+
+class RateController:
+
+    def __init__(self, rows_per_sec=0.0, bytes_per_sec=0.0,
+                 burst_sec=0.1, report_sec=5.0, label='rate'):
+        self.rows_bucket = TokenBucket(
+            rows_per_sec, max(rows_per_sec * burst_sec, 1.0))
+        self.bytes_bucket = TokenBucket(
+            bytes_per_sec, max(bytes_per_sec * burst_sec, 1.0))
+        self.report_sec = report_sec
+        self.label = label
+        self.report_start = time.monotonic()
+        self.received_rows = 0
+        self.sent_rows = 0
+        self.sent_bytes = 0
+        self.coalesced_rows = 0
+
+    @property
+    def unlimited(self):
+        return self.rows_bucket.rate <= 0 and self.bytes_bucket.rate <= 0
+
+    def delay(self, rows=1, nbytes=0):
+        return max(self.rows_bucket.delay(rows), self.bytes_bucket.delay(nbytes))
+
+    def wait(self, rows=1, nbytes=0):
+        delay = self.delay(rows, nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def receive(self, rows):
+        self.received_rows += rows
+
+    def consume(self, rows, nbytes, coalesced_rows=0):
+        self.rows_bucket.consume(rows)
+        self.bytes_bucket.consume(nbytes)
+        self.sent_rows += rows
+        self.sent_bytes += nbytes
+        self.coalesced_rows += coalesced_rows
+
+    def report(self, lag_rows=0, lag_sec=0.0, force=False):
+        now = time.monotonic()
+        elapsed = now - self.report_start
+        if not force and (self.report_sec <= 0 or elapsed < self.report_sec):
+            return
+        elapsed = max(elapsed, 1e-9)
+        print('[{}] sent {:.1f} rows/sec ({:.1f} bytes/sec), received {:.1f} rows/sec, coalesced {} rows, lag {} rows ({:.3f}s)'.format(
+            self.label,
+            self.sent_rows / elapsed,
+            self.sent_bytes / elapsed,
+            self.received_rows / elapsed,
+            self.coalesced_rows,
+            lag_rows,
+            lag_sec))
+        self.report_start = now
+        self.received_rows = 0
+        self.sent_rows = 0
+        self.sent_bytes = 0
+        self.coalesced_rows = 0
+
+
+def interval_to_rate(interval):
+    if interval is None or interval <= 0:
+        return 0.0
+    return 1.0 / interval
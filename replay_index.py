@@ -0,0 +1,177 @@
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def source_stat(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def csv_index_path(path):
+    return path + '.index.npz'
+
+
+def build_csv_index(path, every_rows=4096, block_bytes=64 << 20):
+    # NOTE: sparse index, the byte offset and step of every N-th row; a seek
+    # lands at most every_rows rows before the requested step
+    steps = []
+    offsets = []
+    with open(path, 'rb') as f:
+        header = f.readline()
+        size = os.fstat(f.fileno()).st_size
+        block_offset = f.tell()
+        row_starts = [block_offset] if block_offset < size else []
+        row = 0
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            starts = block_offset + ends + 1
+            rows = row + 1 + np.arange(len(starts))
+            row_starts.extend(starts[(rows % every_rows == 0) & (starts < size)])
+            row += len(starts)
+            block_offset += len(block)
+        for start in row_starts:
+            first_field = os.pread(f.fileno(), 64, int(start)).split(b',', 1)[0]
+            if not first_field.strip():
+                continue
+            steps.append(int(float(first_field)))
+            offsets.append(int(start))
+    return {
+        'header': header.decode().rstrip('\r\n'),
+        'steps': np.array(steps, dtype=np.int64),
+        'offsets': np.array(offsets, dtype=np.int64),
+        'size': size,
+    }
+
+
+def load_csv_index(path, every_rows=4096, rebuild=False):
+    index_path = csv_index_path(path)
+    size, mtime_ns = source_stat(path)
+    if not rebuild and os.path.exists(index_path):
+        index = np.load(index_path)
+        if int(index['size']) == size and int(index['mtime_ns']) == mtime_ns:
+            return {
+                'header': str(index['header']),
+                'steps': index['steps'],
+                'offsets': index['offsets'],
+                'size': size,
+            }
+        print('[INFO] {} is stale, rebuilding'.format(index_path))
+    index = build_csv_index(path, every_rows)
+    np.savez(index_path, header=index['header'], steps=index['steps'],
+             offsets=index['offsets'], size=size, mtime_ns=mtime_ns)
+    print('[INFO] indexed {} row offsets of {} into {}'.format(
+        len(index['steps']), path, index_path))
+    return index
+
+
+def csv_byte_ranges(index, start_step=None, end_step=None,
+                    chunk_bytes=8 << 20):
+    # NOTE: steps must be non-decreasing; ranges are split at indexed row starts
+    steps = index['steps']
+    offsets = index['offsets']
+    if len(offsets) == 0:
+        return []
+    begin = 0
+    if start_step is not None:
+        # NOTE: the last indexed row before start_step, rows of start_step may
+        # begin before an indexed row with the same step
+        begin = max(np.searchsorted(steps, start_step, 'left') - 1, 0)
+    end = len(offsets)
+    if end_step is not None:
+        end = np.searchsorted(steps, end_step, 'right')
+    bounds = np.append(offsets, index['size'])
+    ranges = []
+    range_start = bounds[begin]
+    for i in range(begin + 1, end + 1):
+        if bounds[i] - range_start >= chunk_bytes or i == end:
+            ranges.append((int(range_start), int(bounds[i])))
+            range_start = bounds[i]
+    return ranges
+
+
+def read_csv_range(path, byte_range):
+    begin, end = byte_range
+    with open(path, 'rb') as f:
+        data = os.pread(f.fileno(), end - begin, begin)
+    if not data.strip():
+        return np.zeros((0, 0))
+    try:
+        return np.loadtxt(io.BytesIO(data), delimiter=',', dtype=np.float64,
+                          ndmin=2)
+    except ValueError:
+        # NOTE: empty fields are NaN, like csv-pipe-rerun.py
+        return np.atleast_2d(np.genfromtxt(
+            io.BytesIO(data), delimiter=',', dtype=np.float64))
+
+
+def file_digest(path, block_bytes=1 << 20):
+    if xxhash is not None:
+        h = xxhash.xxh3_128()
+    else:
+        h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def ply_file_id(i, path, off_auto_index=False):
+    # NOTE: same id as rerun-ply.py
+    if not off_auto_index:
+        match = re.search('([0-9]+)\\.ply', path)
+        if match:
+            return int(match.group(1))
+    return i
+
+
+def load_ply_index(index_path, files, off_auto_index=False, workers=4):
+    previous = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            previous = {entry['path']: entry for entry in json.load(f)}
+    entries = []
+    stale = []
+    for i, path in enumerate(files):
+        path = os.path.abspath(path)
+        size, mtime_ns = source_stat(path)
+        entry = previous.get(path)
+        if entry is None or entry['size'] != size or entry['mtime_ns'] != mtime_ns:
+            entry = {'path': path, 'size': size, 'mtime_ns': mtime_ns}
+            stale.append(entry)
+        entry['id'] = ply_file_id(i, path, off_auto_index)
+        entries.append(entry)
+    if stale:
+        # hashing is I/O bound, the digests release the GIL on large blocks
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for entry, digest in zip(stale, executor.map(
+                    file_digest, [entry['path'] for entry in stale])):
+                entry['hash'] = digest
+        with open(index_path, 'w') as f:
+            json.dump(entries, f, indent=1)
+        print('[INFO] hashed {} / {} files into {}'.format(
+            len(stale), len(entries), index_path))
+    entries.sort(key=lambda entry: entry['id'])
+    return entries
+
+
+def select_entries(entries, start_id=None, end_id=None):
+    return [entry for entry in entries
+            if (start_id is None or entry['id'] >= start_id)
+            and (end_id is None or entry['id'] <= end_id)]
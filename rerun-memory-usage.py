@@ -1,51 +1,411 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
 import time
+import numpy as np
 import psutil
 import rerun as rr
 
+import rerun_sender
+import retention
 
-def track_memory_usage():
-    addr = '127.0.0.1:9876'
-    recording_id = "test_recording_id"
-    application_id = "{}".format("memory_usage")
-    rr.init(application_id,
-            recording_id=recording_id,
-            spawn=False,
-            )
-    rr.connect(addr=addr)
 
-    rr.log(
-        'memory\\ usage',
+def send_series(entity, steps, values):
+    rerun_sender.send_columns(
+        entity,
+        times=[rr.TimeSequenceColumn("step", steps)],
+        components=[rr.components.ScalarBatch(values)],
+    )
+
+
+class ColumnBuffer:
+
+    def __init__(self, capacity, retained=None):
+        # NOTE: one row per tick, one column per entity; NaN marks a missing sample
+        self.retained = retained
+        self.entities = []
+        self.index = {}
+        self.capacity = capacity
+        self.rows = []
+
+    @property
+    def size(self):
+        return len(self.rows)
+
+    def columns(self, entities):
+        # resolve once per set of entities, the hot path only uses the indices
+        for entity in entities:
+            if entity not in self.index:
+                self.index[entity] = len(self.entities)
+                self.entities.append(entity)
+        return np.array([self.index[entity] for entity in entities],
+                        dtype=np.intp)
+
+    def add(self, step, groups):
+        # NOTE: the first numpy call after the tick sleep costs tens of us (cold
+        # caches), so a tick only appends plain tuples of (columns, values) and
+        # the matrix is filled once per flush
+        if len(self.rows) == self.capacity:
+            self.flush()
+        self.rows.append((step, groups))
+
+    def flush(self):
+        if not self.rows:
+            return
+        steps = np.array([step for step, _ in self.rows], dtype=np.int64)
+        values = np.full((len(self.rows), len(self.entities)), np.nan)
+        for i, (_, groups) in enumerate(self.rows):
+            row = values[i]
+            for columns, group_values in groups:
+                row[columns] = group_values
+        self.rows = []
+        sampled = ~np.isnan(values)
+        for column in np.flatnonzero(sampled.any(axis=0)):
+            mask = sampled[:, column]
+            entity = self.entities[column]
+            send_series(entity, steps[mask], values[mask, column])
+            if self.retained is not None:
+                self.retained.extend(entity, steps[mask], values[mask, column])
+
+
+class UsedMemory:
+
+    def __init__(self, path='/proc/meminfo'):
+        # NOTE: psutil.virtual_memory() parses every field, at 100Hz that is most of the sampling cost
+        self.fd = os.open(path, os.O_RDONLY) if os.path.exists(path) else None
+
+    def sample(self):
+        # used = total - available, same as psutil
+        if self.fd is None:
+            return psutil.virtual_memory().used / (1024 ** 2)
+        # MemTotal and MemAvailable are the first and third lines
+        fields = os.pread(self.fd, 256, 0).split(None, 9)
+        if fields[0] != b'MemTotal:' or fields[6] != b'MemAvailable:':
+            return psutil.virtual_memory().used / (1024 ** 2)
+        return (int(fields[1]) - int(fields[7])) / 1024
+
+
+class ProcessTree:
+
+    def __init__(self, pid, refresh_sec=1.0):
+        self.root = psutil.Process(pid)
+        self.refresh_sec = refresh_sec
+        self.processes = {}
+        self.entities = []
+        self.changed = False
+        self.refreshed = -refresh_sec
+
+    def refresh(self, now):
+        # NOTE: children() walks /proc, so the tree is refreshed less often than it is sampled
+        if now - self.refreshed < self.refresh_sec:
+            return
+        self.refreshed = now
+        try:
+            current = [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            current = []
+        processes = {}
+        for process in current:
+            # keep the old object, cpu_percent() is measured from its previous call
+            processes[process.pid] = self.processes.get(process.pid, process)
+            if process.pid not in self.processes:
+                process.cpu_percent()
+        if processes.keys() != self.processes.keys():
+            self.entities = []
+            for pid, process in processes.items():
+                try:
+                    name = process.name()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    name = ''
+                label = 'process/{}'.format(rr.escape_entity_path_part(
+                    '{} {}'.format(pid, name)))
+                self.entities += [label + '/rss_mb', label + '/cpu_percent']
+            self.changed = True
+        self.processes = processes
+
+    def sample(self, now):
+        # values follow self.entities, NaN for a process that exited since the refresh
+        self.refresh(now)
+        values = []
+        for process in self.processes.values():
+            try:
+                with process.oneshot():
+                    values += [process.memory_info().rss / (1024 ** 2),
+                               process.cpu_percent()]
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                values += [np.nan, np.nan]
+        return values
+
+
+class CounterRates:
+
+    def __init__(self):
+        self.previous = {}
+
+    def sample(self, now, counters):
+        values = {}
+        for name, value in counters.items():
+            if name in self.previous:
+                pre_time, pre_value = self.previous[name]
+                values[name] = (value - pre_value) / max(now - pre_time, 1e-9)
+            self.previous[name] = (now, value)
+        return values
+
+
+class IoCounters:
+
+    SECTOR_SIZE = 512
+
+    def __init__(self):
+        # NOTE: like UsedMemory, read only the needed fields of open /proc files,
+        # psutil checks /sys/block for every line of /proc/diskstats on every call
+        self.diskstats = self.open('/proc/diskstats')
+        self.net_dev = self.open('/proc/net/dev')
+        # whole disks only, partitions are already counted in their disk (same as psutil)
+        self.disks = set()
+        if os.path.isdir('/sys/block'):
+            self.disks = {name.replace('!', '/').encode()
+                          for name in os.listdir('/sys/block')}
+
+    @staticmethod
+    def open(path):
+        return os.open(path, os.O_RDONLY) if os.path.exists(path) else None
+
+    @staticmethod
+    def read(fd):
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(fd, 65536, offset)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+            offset += len(chunk)
+
+    def sample(self):
+        counters = {}
+        if self.diskstats is None:
+            disk = psutil.disk_io_counters()
+            if disk is not None:
+                counters['disk/read_bytes_per_sec'] = disk.read_bytes
+                counters['disk/write_bytes_per_sec'] = disk.write_bytes
+        else:
+            read_sectors = 0
+            write_sectors = 0
+            for line in self.read(self.diskstats).splitlines():
+                fields = line.split()
+                if len(fields) >= 10 and fields[2] in self.disks:
+                    read_sectors += int(fields[5])
+                    write_sectors += int(fields[9])
+            counters['disk/read_bytes_per_sec'] = read_sectors * self.SECTOR_SIZE
+            counters['disk/write_bytes_per_sec'] = write_sectors * self.SECTOR_SIZE
+        if self.net_dev is None:
+            net = psutil.net_io_counters()
+            if net is not None:
+                counters['net/sent_bytes_per_sec'] = net.bytes_sent
+                counters['net/recv_bytes_per_sec'] = net.bytes_recv
+        else:
+            sent = 0
+            recv = 0
+            # two header lines, then "iface: rx_bytes (7 more rx fields) tx_bytes ..."
+            for line in self.read(self.net_dev).splitlines()[2:]:
+                fields = line.split(b':', 1)[-1].split()
+                recv += int(fields[0])
+                sent += int(fields[8])
+            counters['net/sent_bytes_per_sec'] = sent
+            counters['net/recv_bytes_per_sec'] = recv
+        return counters
+
+
+def sample_io(now, rates, io_counters):
+    return rates.sample(now, io_counters.sample())
+
+
+def log_style(entity, name, marker_size=2.0):
+    rerun_sender.log(
+        entity,
         rr.SeriesLine(
             # color=color,
-            name="all",
+            name=name,
         ),
-        # timeless=True,
+        timeless=True,
     )
-    rr.log(
-        'memory\\ usage',
+    rerun_sender.log(
+        entity,
         rr.SeriesPoint(
             # color=color,
-            name="all",
+            name=name,
             marker="circle",
-            marker_size=2.0,
+            marker_size=marker_size,
         ),
-        # timeless=True,
+        timeless=True,
     )
 
-    t = 0
-    while True:
-        memory_info = psutil.virtual_memory()
-        memory_used = memory_info.used / (1024 ** 2)  # MB
 
-        value = memory_used
-        rr.set_time_sequence("step", int(t))
+def track_memory_usage(args):
+    # NOTE: the SDK batcher wakes every 8ms by default (~0.4% of a core on its
+    # own), the samples are already sent as columns once per batch
+    os.environ.setdefault('RERUN_FLUSH_TICK_SECS', str(args.batch_sec))
+    rerun_sender.init(args.app_title,
+                      recording_id=args.recording_id,
+                      spawn=False,
+                      addr=args.addr,
+                      queue_size=args.queue_size,
+                      queue_policy=args.queue_policy,
+                      )
+
+    log_style('memory\\ usage', 'all')
+
+    used_memory = UsedMemory()
+    process_tree = ProcessTree(args.pid) if args.pid else None
+    io_rates = CounterRates()
+    io_counters = IoCounters()
+    retained = retention.RetentionWindow(
+        args.retention_samples, args.retention_sec)
+    # NOTE: every send_columns call costs a fixed overhead, batch by time, not by ticks
+    batch_ticks = max(1, int(round(args.hz * args.batch_sec)))
+    buffer = ColumnBuffer(batch_ticks,
+                          retained if retained.enabled else None)
+    styled = {'memory\\ usage': 'all'}
+
+    def columns(entities):
+        # NOTE: only called when the set of entities changes, not every tick
+        for entity in entities:
+            if entity not in styled:
+                styled[entity] = entity.rsplit('/', 1)[-1]
+                log_style(entity, styled[entity])
+        return buffer.columns(entities)
+
+    period = 1.0 / args.hz
+    io_period = 1.0 / args.io_hz if args.io_hz > 0 else None
+    n_cores = len(psutil.cpu_percent(percpu=True))
+    system_columns = columns(
+        ['memory\\ usage'] +
+        ['cpu/core/{}'.format(i) for i in range(n_cores) if args.per_core])
+    profiler_columns = columns(
+        ['profiler/sample_ms', 'profiler/overhead_percent'])
+    queue_columns = columns(['profiler/queue_depth', 'profiler/queue_dropped'])
+    process_columns = columns([])
+    io_columns = None
+
+    t = 0
+    start = time.perf_counter()
+    deadline = start
+    io_deadline = start
+    report_start = start
+    report_cpu = time.process_time()
+    overhead_percent = 0.0
+    while args.duration <= 0 or time.perf_counter() - start < args.duration:
+        now = time.perf_counter()
+        system_values = [used_memory.sample()]  # MB
+        if args.per_core:
+            system_values += psutil.cpu_percent(percpu=True)
+        process_values = []
+        if process_tree is not None:
+            process_values = process_tree.sample(now)
+            if process_tree.changed:
+                process_columns = columns(process_tree.entities)
+                process_tree.changed = False
+        io_values = {}
+        if io_period is not None and now >= io_deadline:
+            io_values = sample_io(now, io_rates, io_counters)
+            if io_values and (io_columns is None or
+                              len(io_columns) != len(io_values)):
+                io_columns = columns(list(io_values))
+            io_deadline += io_period
+        groups = [
+            (system_columns, system_values),
+            (process_columns, process_values),
+            (profiler_columns,
+             ((time.perf_counter() - now) * 1000.0, overhead_percent)),
+        ]
+        if io_values:
+            groups.append((io_columns, list(io_values.values())))
+        last = buffer.size + 1 == batch_ticks
+        if last:
+            # NOTE: the queue stats are read once per batch, on its last row
+            queue_stats = rerun_sender.stats()
+            groups.append((queue_columns,
+                           (queue_stats['depth'], queue_stats['dropped'])))
+        buffer.add(t, groups)
         t += 1
-        rr.log('memory\\ usage', rr.Scalar(value))
-        print(t, value)
-        time.sleep(0.1)
+        if last:
+            buffer.flush()
+        if retained.due():
+            # NOTE: re-publish only the retained window (one chunk per series)
+            # into a new recording, so the viewer does not grow for days
+            buffer.flush()
+            windows = list(retained.windows())
+            rerun_sender.rotate('{}-{}'.format(
+                args.recording_id, retained.epoch))
+            for entity, name in styled.items():
+                log_style(entity, name)
+            for entity, steps, series_values in windows:
+                send_series(entity, steps, series_values)
+            if args.verbose:
+                print(t, 'republished {} series'.format(len(windows)))
+
+        if now - report_start >= 1.0:
+            # NOTE: cpu time of this process (sampling + logging) per wall time
+            cpu_now = time.process_time()
+            overhead_percent = (cpu_now - report_cpu) / \
+                (now - report_start) * 100.0
+            report_start = now
+            report_cpu = cpu_now
+            if args.verbose:
+                print(t, '{:.2f}% of a core'.format(overhead_percent))
+
+        deadline += period
+        delay = deadline - time.perf_counter()
+        if delay < 0:
+            deadline = time.perf_counter()
+        else:
+            time.sleep(delay)
+    buffer.flush()
+    rerun_sender.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--addr', default='127.0.0.1:9876')
+    parser.add_argument('-a', '--app-title', default='memory_usage')
+    parser.add_argument('--recording_id', default='test_recording_id')
+    parser.add_argument(
+        '-p',
+        '--pid',
+        type=int,
+        default=None,
+        help='profile RSS/CPU of this process and its children')
+    parser.add_argument('--hz', type=float, default=10.0,
+                        help='sampling rate of memory, cpu and process metrics '
+                        '(measured ~1.4%% of a core at 100Hz and ~0.5%% at 10Hz, '
+                        'a bare 100Hz sleep loop alone is ~0.4%%; --per-core and --pid cost more)')
+    parser.add_argument('--io-hz', type=float, default=1.0,
+                        help='sampling rate of disk and network counters '
+                        '(0: off, each Hz adds ~0.02%% of a core)')
+    parser.add_argument('--per-core', action='store_true',
+                        help='sample per-core cpu usage')
+    parser.add_argument('--batch-sec', type=float, default=1.0,
+                        help='send samples as columns every N seconds')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='stop after N seconds (0: run forever)')
+    parser.add_argument(
+        '--retention-samples',
+        type=int,
+        default=0,
+        help='keep the last N samples of every series (0: keep everything in the viewer)')
+    parser.add_argument(
+        '--retention-sec',
+        type=float,
+        default=3600.0,
+        help='start a new recording with only the retained samples every N seconds')
+    rerun_sender.add_queue_arguments(parser)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    track_memory_usage(args)
 
 
 if __name__ == "__main__":
-    track_memory_usage()
+    main()
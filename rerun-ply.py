@@ -3,12 +3,29 @@ import time
 import re
 import os
 import argparse
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
 import math
+import multiprocessing
+import uuid
 
 import rerun as rr
 import trimesh
 import numpy as np
 
+import ply_reader
+import rerun_sender
+import rrd_tools
+import synthetic_scene
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 
 def setdiff2d_set(src, dst):
     src_set = set(map(tuple, src))
@@ -40,67 +57,340 @@ def count_setdiff2d_set_numpy(src, dst):
     return (len(deleted_set), len(added_set))
 
 
+def diff_by_index(src, dst):
+    min_length = min(len(src), len(dst))
+    if min_length == 0:
+        changed_mask = np.zeros(0, dtype=bool)
+    else:
+        changed_mask = np.any(src[:min_length] != dst[:min_length], axis=1)
+    added_cnt = len(dst) - min_length
+    deleted_cnt = len(src) - min_length
+    return (changed_mask, added_cnt, deleted_cnt)
+
+
+def quantize_positions(positions, tolerance):
+    if tolerance > 0:
+        return np.floor(positions / tolerance).astype(np.int64)
+    return np.ascontiguousarray(positions)
+
+
+def splitmix64(x):
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def pack_voxel_keys(cells):
+    # NOTE: 64bit hash of the voxel cell, collisions are negligible (~n^2 / 2^64)
+    cells = cells.astype(np.uint64)
+    keys = splitmix64(cells[:, 0])
+    keys = splitmix64(keys + cells[:, 1])
+    keys = splitmix64(keys + cells[:, 2])
+    return keys.view(np.int64)
+
+
+def structured_keys(cells):
+    cells = np.ascontiguousarray(cells)
+    nrows, ncols = cells.shape
+    dtype = {'names': ['f{}'.format(i) for i in range(ncols)],
+             'formats': ncols * [cells.dtype]}
+    return cells.view(dtype).ravel()
+
+
+def isin_sorted(keys, sorted_keys):
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    index = np.searchsorted(sorted_keys, keys)
+    index[index == len(sorted_keys)] = 0
+    return sorted_keys[index] == keys
+
+
+# the 26 cells around a cell
+NEIGHBOUR_OFFSETS = np.array(
+    [offset for offset in itertools.product((-1, 0, 1), repeat=3) if any(offset)])
+
+
+def probe_cells(cells, keys, order, sorted_keys, make_keys, neighbours):
+    # NOTE: most points match in their own cell (queried in sorted order, searchsorted
+    # is much faster on sorted input), only the rest probe the neighbours
+    matched = np.empty(len(keys), dtype=bool)
+    matched[order] = isin_sorted(keys[order], sorted_keys)
+    rest = np.flatnonzero(~matched)
+    for offset in neighbours:
+        if len(rest) == 0:
+            break
+        keys = make_keys(cells[rest] + offset)
+        rest_order = np.argsort(keys)
+        found = np.empty(len(rest), dtype=bool)
+        found[rest_order] = isin_sorted(keys[rest_order], sorted_keys)
+        matched[rest[found]] = True
+        rest = rest[~found]
+    return matched
+
+
+class PositionDiffIndex:
+
+    def __init__(self, tolerance=1e-6, backend='voxel'):
+        # NOTE: with tolerance > 0, positions are binned on a grid of tolerance and two
+        # points match when their cells are at most one apart on every axis. The match
+        # is symmetric: points closer than tolerance on every axis always match, points
+        # 2 * tolerance or more apart on an axis never do. Both backends give the same
+        # result, the voxel backend hashes the cells, numpy compares them exactly.
+        self.tolerance = tolerance
+        self.backend = backend
+        self.pre = None
+
+    def make_keys(self, cells):
+        if self.backend == 'voxel' and self.tolerance > 0:
+            return pack_voxel_keys(cells)
+        # fallback: exact structured view (same as setdiff2d_set_numpy)
+        return structured_keys(cells)
+
+    def diff(self, positions):
+        # counts are in points, a point is added (deleted) when no previous (current)
+        # point matches it
+        cells = quantize_positions(positions, self.tolerance)
+        neighbours = NEIGHBOUR_OFFSETS if self.tolerance > 0 else []
+        keys = self.make_keys(cells)
+        # the order of equal keys does not matter here, quicksort is ~4x faster than stable
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        if self.pre is None:
+            added_mask = np.ones(len(keys), dtype=bool)
+            deleted_cnt = 0
+        else:
+            pre_cells, pre_keys, pre_order, pre_sorted_keys = self.pre
+            added_mask = ~probe_cells(cells, keys, order, pre_sorted_keys,
+                                      self.make_keys, neighbours)
+            deleted_cnt = int(np.count_nonzero(~probe_cells(
+                pre_cells, pre_keys, pre_order, sorted_keys, self.make_keys,
+                neighbours)))
+        self.pre = (cells, keys, order, sorted_keys)
+        return (added_mask, int(np.count_nonzero(added_mask)), deleted_cnt)
+
+
+def block_digest(*blocks):
+    if xxhash is not None:
+        h = xxhash.xxh3_128()
+    else:
+        h = hashlib.blake2b(digest_size=16)
+    for block in blocks:
+        h.update(np.ascontiguousarray(block))
+    return h.digest()
+
+
+def split_by_cell(positions, cell_size):
+    # NOTE: yield (cell, point indices) per voxel-grid cell, keeping the original order in a cell
+    if len(positions) == 0:
+        return
+    cells = quantize_positions(positions, cell_size)
+    keys = pack_voxel_keys(cells)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    ends = np.append(starts[1:], len(order))
+    for begin, end in zip(starts, ends):
+        index = order[begin:end]
+        yield (tuple(cells[index[0]]), index)
+
+
+def lod_priority(positions, lod_order='random', cell_size=0.5):
+    # NOTE: fixed seed, the same number of points gives the same order every frame
+    order = np.random.default_rng(0).permutation(len(positions))
+    if lod_order != 'voxel' or len(positions) == 0:
+        return order
+    # one point per voxel cell first, the rest in random order
+    keys = pack_voxel_keys(quantize_positions(positions[order], cell_size))
+    sorted_index = np.argsort(keys, kind='stable')
+    sorted_keys = keys[sorted_index]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    is_representative = np.zeros(len(keys), dtype=bool)
+    is_representative[sorted_index[is_first]] = True
+    return np.concatenate(
+        (order[is_representative], order[~is_representative]))
+
+
+def lod_levels(n_points, initial_points, growth):
+    # NOTE: level k covers [initial * growth^(k-1), initial * growth^k) of the priority order
+    begin = 0
+    end = max(1, initial_points)
+    while begin < n_points:
+        yield (begin, min(end, n_points))
+        begin = end
+        end = max(end + 1, int(end * growth))
+
+
+def encode_block(positions, colors, radii, encoding='compact'):
+    # NOTE: returns (positions, colors, radii, origin), origin is None unless encoding is 'local'
+    if encoding == 'raw':
+        return (positions, colors, radii, None)
+    colors = np.clip(colors[:, :3], 0, 255).astype(np.uint8)
+    radii = np.asarray(radii[:1], dtype=np.float32)
+    if encoding == 'local' and len(positions):
+        # positions relative to the block origin keep float32 precision far from the world origin
+        origin = positions.min(axis=0)
+        return ((positions - origin).astype(np.float32), colors, radii, origin)
+    return (positions.astype(np.float32), colors, radii, None)
+
+
+def encoded_point_nbytes(positions, colors, radii, encoding='compact'):
+    if encoding == 'raw':
+        return positions.itemsize * positions.shape[1] + \
+            colors.itemsize * colors.shape[1] + radii.itemsize
+    return np.dtype(np.float32).itemsize * positions.shape[1] + 3
+
+
 def load_plyfile(filepath):
-    point_cloud = trimesh.load(filepath)
+    point_cloud = ply_reader.read_binary_ply(filepath)
+    if point_cloud is None:
+        point_cloud = trimesh.load(filepath)
     return point_cloud
 
 
-def load_example_point_clouds(num_points=10000):
-    class ExamplePcd:
+class ExamplePcd:
+
+    def __init__(self, vertices):
+        self.vertices = vertices
 
-        def __init__(self, vertices):
-            self.vertices = vertices
 
+def load_example_point_clouds(num_points=10000):
     # positions = np.random.rand(num_points, 3)
 
     indices = np.arange(num_points)
-    np.random.seed(42)
-    positions = np.random.rand(num_points, 3) + \
+    # NOTE: local RandomState, this may run on prefetch threads
+    positions = np.random.RandomState(42).rand(num_points, 3) + \
         indices[:, None] / 10000 * 0.5
     return ExamplePcd(positions)
 
 
+def load_frame(i, file, off_auto_index=False):
+    id = i
+    if not off_auto_index:
+        match = re.search('([0-9]+)\\.ply', file)
+        if match:
+            id = int(match.group(1))
+    if file == 'example':
+        num_points = 10000 + i * 1000
+        pcd = load_example_point_clouds(num_points)
+        pcd.vertices[i * 1000:(i + 1) * 1000, :] += [0.1, 0.1, 0.1]
+        # if i == 2:
+        # pcd.vertices = pcd.vertices[:1000]
+        # if i == 4:
+        # pcd.vertices = np.delete(pcd.vertices, 1, 0)
+    else:
+        pcd = load_plyfile(file)
+    return (id, pcd)
+
+
+def prefetch_frames(files, load, prefetch_depth, executor):
+    # NOTE: keep up to prefetch_depth frames loading while the caller logs the current one
+    if prefetch_depth <= 0:
+        for i, file in enumerate(files):
+            yield load(i, file)
+        return
+    pending = collections.deque()
+    file_iter = enumerate(files)
+    for i, file in itertools.islice(file_iter, prefetch_depth):
+        pending.append(executor.submit(load, i, file))
+    while pending:
+        frame = pending.popleft().result()
+        for i, file in itertools.islice(file_iter, 1):
+            pending.append(executor.submit(load, i, file))
+        yield frame
+
+
+def load_shard_frame(i, file, shard_index=0, shard_count=1,
+                     off_auto_index=False):
+    # NOTE: i is the index in the shard's files, keep the auto index of the whole list
+    return load_frame(i * shard_count + shard_index, file, off_auto_index)
+
+
+def synthetic_frames(args):
+    # NOTE: frames are generated lazily in place, so they are not prefetched
+    scene = synthetic_scene.SyntheticScene(
+        num_points=args.synthetic_points,
+        churn=args.synthetic_churn,
+        locality=args.synthetic_locality,
+        color_mode=args.synthetic_color_mode,
+        sensor_speed=args.synthetic_sensor_speed,
+        sensor_range=args.synthetic_sensor_range or None,
+        seed=args.synthetic_seed)
+    for i, pcd in enumerate(scene.frames(args.synthetic_frames)):
+        yield (i, pcd)
+
+
+STAGES = ['load', 'color', 'diff', 'encode', 'send', 'total']
+
+
 class RerunPlySender:
 
-    def __init__(self):
+    def __init__(self, diff_tolerance=1e-6, diff_backend='voxel',
+                 shard_index=0, shard_count=1, encoding='compact',
+                 instrumentation=False, shard_mode='points'):
+        self.encoding = encoding
+        self.instrumentation = instrumentation
+        self.stage_sec = dict.fromkeys(STAGES, 0.0)
+        self.frame_bytes = {'raw': 0, 'encoded': 0}
+        self.frame_points = {'total': 0, 'sent': 0, 'blocks_sent': 0}
+        self.position_index = PositionDiffIndex(diff_tolerance, diff_backend)
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        # NOTE: points: each shard logs a partition of every frame under its own entities,
+        # frames: each shard logs whole frames, so no state is kept across frames
+        self.shard_mode = shard_mode if shard_count > 1 else 'points'
+        self.data_root = "PLY\\ Point\\ Cloud/data"
+        if shard_count > 1 and self.shard_mode == 'points':
+            self.data_root = '{}/shard{}'.format(self.data_root, shard_index)
         self.pre_positions = np.array([])
-        self.pre_colors = np.array([])
         self.pre_max_index = 0
+        self.block_digests = {}
+        self.block_cache_stats = {'hit': 0, 'miss': 0, 'cleared': 0}
+        self.lod_priority = None
 
     def log(self, point_cloud, point_size=0.001,
-            ply_division_number=100, ply_block_number=1000, ply_stride=1, splitting_method='overall', enable_diff_by_index=False, enable_diff_by_position=False):
-        positions = np.array(point_cloud.vertices)
-        print('the number of point clouds:', len(positions))
-
-        if False:
-            start = time.perf_counter()
-            if True:
-                deleted_points, added_points = count_setdiff2d_set_numpy(
-                    self.pre_positions, positions)
-            else:
-                deleted_points, added_points = count_setdiff2d_set(
-                    self.pre_positions, positions)
-
-            diff_points = deleted_points + added_points
-            print(
-                f"({added_points}(added) + {deleted_points}(deleted) = {diff_points}(diff)) / {len(positions)}(current) ({diff_points/len(positions)*100.0:.3f}%)")
-            end = time.perf_counter()
-            print('{:.2f}s'.format(end - start))
-
+            ply_division_number=100, ply_block_number=1000, ply_stride=1, splitting_method='overall', enable_diff_by_index=False, enable_diff_by_position=False, cell_size=0.5,
+            lod_order='random', lod_initial_points=100000, lod_growth=4.0, lod_points_per_sec=0.0, lod_bytes_per_sec=0.0,
+            load_sec=0.0):
+        frame_start = time.perf_counter()
+        self.stage_sec = dict.fromkeys(STAGES, 0.0)
+        self.stage_sec['load'] = load_sec
+        self.block_cache_stats = {'hit': 0, 'miss': 0, 'cleared': 0}
+        self.frame_bytes = {'raw': 0, 'encoded': 0}
+        self.frame_points = {'total': 0, 'sent': 0, 'blocks_sent': 0}
+        positions = np.asarray(point_cloud.vertices)
+        num_points = len(positions)
+        print('the number of point clouds:', num_points)
+        if self.shard_mode == 'frames':
+            # whole frames interleave between shards, drop the blocks of the previous frame
+            rerun_sender.log(self.data_root, rr.Clear.recursive())
+            self.block_digests = {}
+            self.pre_max_index = 0
+
+        start = time.perf_counter()
+        shard = self.shard_points(positions, enable_diff_by_index, cell_size)
+        positions = positions[shard]
+        self.frame_points['total'] = len(positions)
+        self.stage_sec['diff'] += time.perf_counter() - start
+
+        start = time.perf_counter()
         if hasattr(point_cloud, 'visual') and hasattr(
                 point_cloud.visual, 'vertex_colors'):
-            colors = np.array(point_cloud.visual.vertex_colors[:, :3])
+            colors = np.array(point_cloud.visual.vertex_colors[shard, :3])
         else:
             # white
             # colors = np.ones((positions.shape[0], 3)) * 1.0
 
             # gradation
-            num_points = len(positions)
+            gradation = np.linspace(0, 255, num_points, dtype='int')[shard]
             colors = np.column_stack((
-                np.linspace(0, 255, num_points, dtype='int'),  # r
-                np.linspace(0, 255, num_points, dtype='int'),  # g
-                np.linspace(0, 255, num_points, dtype='int'),  # b
+                gradation,  # r
+                gradation,  # g
+                gradation,  # b
             ))
+        self.stage_sec['color'] += time.perf_counter() - start
+        start = time.perf_counter()
 
         if enable_diff_by_index and enable_diff_by_position:
             print(
@@ -108,86 +398,312 @@ class RerunPlySender:
 
         if enable_diff_by_index:
             # NOTE: compare with same index
-            min_length = min(len(self.pre_positions), len(positions))
-            no_change_cnt = 0
-            changed_cnt = 0
-            added_cnt = 0
-            deleted_cnt = 0
-            for i in range(min_length):
-                if np.array_equal(self.pre_positions[i], positions[i]):
-                    no_change_cnt += 1  # no change
-                else:
-                    colors[i] = [255, 255, 0]  # changed
-                    changed_cnt += 1
-            for i in range(min_length, len(positions)):
-                colors[i] = [0, 255, 0]  # added
-                added_cnt += 1
-            deleted_cnt = max(0, len(self.pre_positions) - len(positions))
+            changed_mask, added_cnt, deleted_cnt = diff_by_index(
+                self.pre_positions, positions)
+            min_length = len(changed_mask)
+            changed_cnt = int(np.count_nonzero(changed_mask))
+            no_change_cnt = min_length - changed_cnt
+            colors[:min_length][changed_mask] = [255, 255, 0]  # changed
+            colors[min_length:] = [0, 255, 0]  # added
             diff_cnt = changed_cnt + added_cnt + deleted_cnt
-            print(f"{no_change_cnt}(no_change), ({changed_cnt}(changed) + {added_cnt}(added) + {deleted_cnt}(deleted) = {diff_cnt}(diff)) / {len(positions)}(current) ({diff_cnt/len(positions)*100.0:.3f}%)")
+            print(f"{no_change_cnt}(no_change), ({changed_cnt}(changed) + {added_cnt}(added) + {deleted_cnt}(deleted) = {diff_cnt}(diff)) / {len(positions)}(current) ({diff_cnt/max(len(positions), 1)*100.0:.3f}%)")
 
         if enable_diff_by_position:
-            deleted_set, added_set = setdiff2d_set(
-                self.pre_positions, positions)
-            for i in range(0, len(positions)):
-                if tuple(positions[i]) in added_set:
-                    colors[i, :3] = [0, 255, 0]  # diff(changed or added)
-            changed_or_added_cnt = len(added_set)
-            changed_or_deleted_cnt = len(deleted_set)
+            added_mask, changed_or_added_cnt, changed_or_deleted_cnt = self.position_index.diff(
+                positions)
+            colors[added_mask] = [0, 255, 0]  # diff(changed or added)
             diff_cnt = changed_or_added_cnt + changed_or_deleted_cnt
             print(
-                f"({changed_or_added_cnt}(changed or added) + {changed_or_deleted_cnt}(changed or deleted) = {diff_cnt}(diff)) / {len(positions)}(current) ({diff_cnt/len(positions)*100.0:.3f}%)")
+                f"({changed_or_added_cnt}(changed or added) + {changed_or_deleted_cnt}(changed or deleted) = {diff_cnt}(diff)) / {len(positions)}(current) ({diff_cnt/max(len(positions), 1)*100.0:.3f}%)")
+
+        self.stage_sec['diff'] += time.perf_counter() - start
 
         radii = np.full(positions.shape[0], point_size)
+        use_colors = enable_diff_by_index or enable_diff_by_position
 
         # ply_stride # 1 to ply_division_number
         if splitting_method == 'overall':
             for offset in range(0, ply_division_number, ply_stride):
-                rr.log(
-                    "PLY\\ Point\\ Cloud/data/({}\\ at\\ {})".format(offset +
-                                                                     1, ply_division_number),
-                    rr.Points3D(
-                        positions=positions[offset::ply_division_number],
-                        colors=colors[offset::ply_division_number],
-                        radii=radii[offset::ply_division_number]))
+                label = "{}/({}\\ at\\ {})".format(
+                    self.data_root, offset + 1, ply_division_number)
+                self.send_points(label,
+                                 positions[offset::ply_division_number],
+                                 colors[offset::ply_division_number],
+                                 radii[offset::ply_division_number])
         elif splitting_method == 'order':
             n_positions = len(positions)
             n_block_points = ply_block_number
             n_blocks = math.ceil(n_positions / n_block_points)
-            skip_cnt = 0
+            block_digests = {}
             for i in range(0, n_blocks):
                 offset = n_block_points * i
-                label = "PLY\\ Point\\ Cloud/data/({})".format(i)
-                pre_positions_block = np.array(
-                    self.pre_positions[offset:offset + n_block_points:ply_stride])
-                positions_block = np.array(
-                    positions[offset:offset + n_block_points:ply_stride])
-                pre_colors_block = np.array(
-                    self.pre_colors[offset:offset + n_block_points:ply_stride])
-                colors_block = np.array(
-                    colors[offset:offset + n_block_points:ply_stride])
-                if np.array_equal(pre_positions_block, positions_block) and (
-                        (not enable_diff_by_index and not enable_diff_by_position) or np.array_equal(pre_colors_block, colors_block)):
-                    skip_cnt += 1
-                    # print('skipped', label, '/', n_blocks)
-                else:
-                    rr.log(label,
-                           rr.Points3D(
-                               positions=positions_block,
-                               colors=colors_block,
-                               radii=radii[offset:offset + n_block_points:ply_stride]))
-            print(f'skipped {skip_cnt} / {n_blocks}')
+                label = "{}/({})".format(self.data_root, i)
+                block = slice(offset, offset + n_block_points, ply_stride)
+                self.log_block(label, positions[block], colors[block],
+                               radii[block], use_colors, block_digests)
             self.pre_max_index = max(self.pre_max_index, n_blocks)
             for i in range(n_blocks, self.pre_max_index):
-                label = "PLY\\ Point\\ Cloud/data/({})".format(i)
-                rr.log(label, rr.Clear.recursive())
+                label = "{}/({})".format(self.data_root, i)
+                rerun_sender.log(label, rr.Clear.recursive())
+            self.finish_blocks(block_digests, clear=False)
+        elif splitting_method == 'spatial':
+            block_digests = {}
+            for cell, index in split_by_cell(positions, cell_size):
+                index = index[::ply_stride]
+                label = "{}/cell/({}_{}_{})".format(self.data_root, *cell)
+                self.log_block(label, positions[index], colors[index],
+                               radii[index], use_colors, block_digests)
+            self.finish_blocks(block_digests, clear=True)
+        elif splitting_method == 'lod':
+            if lod_order != 'voxel' and self.lod_priority is not None and len(
+                    self.lod_priority) == len(positions):
+                priority = self.lod_priority
+            else:
+                priority = lod_priority(positions, lod_order, cell_size)
+            self.lod_priority = priority
+            bytes_per_point = encoded_point_nbytes(
+                positions, colors, radii, self.encoding)
+            points_per_sec = min(
+                lod_points_per_sec if lod_points_per_sec > 0 else math.inf,
+                lod_bytes_per_sec / bytes_per_point if lod_bytes_per_sec > 0 else math.inf)
+            # NOTE: the budget is shared by all shards sending at the same time
+            points_per_sec /= self.shard_count
+            block_digests = {}
+            for level, (begin, end) in enumerate(
+                    lod_levels(len(priority), lod_initial_points, lod_growth)):
+                index = priority[begin:end]
+                label = "{}/lod/({})".format(self.data_root, level)
+                sent = self.log_block(label, positions[index], colors[index],
+                                      radii[index], use_colors, block_digests)
+                if sent and points_per_sec < math.inf:
+                    time.sleep(len(index) / points_per_sec)
+            self.finish_blocks(block_digests, clear=True)
         else:
             print(f"[ERR] Invalid splitting_method '{splitting_method}'")
+        raw_bytes = self.frame_bytes['raw']
+        encoded_bytes = self.frame_bytes['encoded']
+        print(f"bytes: {raw_bytes}(raw) -> {encoded_bytes}({self.encoding}) ({encoded_bytes / max(raw_bytes, 1) * 100.0:.1f}%)")
         label = "PLY\\ Point\\ Cloud/info"
-        rr.log(label, rr.AnyValues(length=len(positions)))
+        if self.shard_mode == 'frames' or self.shard_index == 0:
+            rerun_sender.log(label, rr.AnyValues(length=num_points))
 
-        self.pre_positions = positions
-        self.pre_colors = colors
+        if enable_diff_by_index:
+            self.pre_positions = positions
+        else:
+            self.pre_positions = np.array([])
+
+        self.stage_sec['total'] = load_sec + time.perf_counter() - frame_start
+        print('stages: ' + ', '.join('{} {:.2f}ms'.format(stage, sec * 1000.0)
+                                     for stage, sec in self.stage_sec.items()))
+        if self.instrumentation:
+            self.log_instrumentation()
+
+    def frame_stats(self):
+        stats = {'{}_ms'.format(stage): sec * 1000.0
+                 for stage, sec in self.stage_sec.items()}
+        stats['points'] = self.frame_points['total']
+        stats['points_sent'] = self.frame_points['sent']
+        stats['blocks_sent'] = self.frame_points['blocks_sent']
+        stats['blocks_skipped'] = self.block_cache_stats['hit']
+        stats['blocks_cleared'] = self.block_cache_stats['cleared']
+        stats['bytes_raw'] = self.frame_bytes['raw']
+        stats['bytes_sent'] = self.frame_bytes['encoded']
+        return stats
+
+    def log_instrumentation(self):
+        prefix = 'instrumentation'
+        if self.shard_count > 1:
+            prefix = '{}/shard{}'.format(prefix, self.shard_index)
+        for name, value in self.frame_stats().items():
+            group = 'stage' if name.endswith('_ms') else 'counter'
+            rerun_sender.log('{}/{}/{}'.format(prefix, group, name),
+                             rr.Scalar(value))
+        for name, value in rerun_sender.stats().items():
+            rerun_sender.log('{}/queue/{}'.format(prefix, name),
+                             rr.Scalar(value))
+
+    def shard_points(self, positions, enable_diff_by_index, cell_size):
+        # NOTE: a point stays in the same shard across frames, by its index for
+        # the diff by index and by its cell otherwise, so each shard diffs its own part
+        if self.shard_count <= 1 or self.shard_mode != 'points':
+            return slice(None)
+        if enable_diff_by_index:
+            return slice(self.shard_index, None, self.shard_count)
+        keys = pack_voxel_keys(quantize_positions(positions, cell_size))
+        return np.flatnonzero(
+            keys.view(np.uint64) % np.uint64(self.shard_count) == np.uint64(self.shard_index))
+
+    def log_block(self, label, positions_block, colors_block,
+                  radii_block, use_colors, block_digests):
+        # NOTE: colors only matter for skipping when they carry diff highlights
+        start = time.perf_counter()
+        if use_colors:
+            digest = block_digest(positions_block, colors_block)
+        else:
+            digest = block_digest(positions_block)
+        block_digests[label] = digest
+        self.stage_sec['diff'] += time.perf_counter() - start
+        if self.block_digests.get(label) == digest:
+            self.block_cache_stats['hit'] += 1
+            return False
+        self.block_cache_stats['miss'] += 1
+        self.send_points(label, positions_block, colors_block, radii_block)
+        return True
+
+    def send_points(self, label, positions_block, colors_block, radii_block):
+        start = time.perf_counter()
+        self.frame_points['sent'] += len(positions_block)
+        self.frame_points['blocks_sent'] += 1
+        self.frame_bytes['raw'] += positions_block.nbytes + \
+            colors_block.nbytes + radii_block.nbytes
+        positions_block, colors_block, radii_block, origin = encode_block(
+            positions_block, colors_block, radii_block, self.encoding)
+        self.frame_bytes['encoded'] += positions_block.nbytes + \
+            colors_block.nbytes + radii_block.nbytes
+        encoded = time.perf_counter()
+        self.stage_sec['encode'] += encoded - start
+        if origin is not None:
+            self.frame_bytes['encoded'] += origin.nbytes
+            rerun_sender.log(label, rr.Transform3D(translation=origin))
+        rerun_sender.log(label,
+                         rr.Points3D(
+                             positions=positions_block,
+                             colors=colors_block,
+                             radii=radii_block))
+        self.stage_sec['send'] += time.perf_counter() - encoded
+
+    def finish_blocks(self, block_digests, clear):
+        stats = self.block_cache_stats
+        stale_labels = self.block_digests.keys() - block_digests.keys()
+        if clear:
+            for label in stale_labels:
+                rerun_sender.log(label, rr.Clear.recursive())
+        stats['cleared'] = len(stale_labels)
+        self.block_digests = block_digests
+        print(f"skipped {stats['hit']} / {len(block_digests)} (hit: {stats['hit']}, miss: {stats['miss']}, cleared: {stats['cleared']})")
+
+
+def shard_mode(args):
+    # NOTE: without the diff nor a generated scene no state is kept across frames,
+    # so whole frames are sharded; otherwise the points of every frame are
+    if args.enable_diff_by_index or args.enable_diff_by_position or \
+            args.synthetic_frames > 0:
+        return 'points'
+    return 'frames'
+
+
+def run(args, files, shard_index=0, shard_count=1, barrier=None):
+    save_path = args.save
+    if save_path and shard_count > 1:
+        save_path = rrd_tools.shard_rrd_path(args.save, shard_index)
+    rerun_sender.init(
+        "{}".format(args.app_title),
+        recording_id=args.recording_id,
+        spawn=args.spawn,
+        addr=args.addr,
+        save=save_path,
+        queue_size=args.queue_size,
+        queue_policy=args.queue_policy,
+        label='queue/{}'.format(shard_index))
+
+    print('[raw input]', files)
+    files = files[args.offset:]
+    files = files[::args.interval]
+    print('[filtered input]:', files)
+    mode = shard_mode(args)
+    if shard_count > 1 and mode == 'frames':
+        files = files[shard_index::shard_count]
+        print('[shard input]:', files)
+        # frames are independent, the workers do not wait for each other
+        barrier = None
+
+    ply_sender = RerunPlySender(
+        args.diff_tolerance, args.diff_backend, shard_index, shard_count,
+        args.encoding, args.instrumentation, mode)
+    if args.prefetch_executor == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.prefetch_workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.prefetch_workers)
+    load = functools.partial(load_frame, off_auto_index=args.off_auto_index)
+    if shard_count > 1 and mode == 'frames':
+        load = functools.partial(load_shard_frame, shard_index=shard_index,
+                                 shard_count=shard_count,
+                                 off_auto_index=args.off_auto_index)
+    with executor:
+        if args.synthetic_frames > 0:
+            frames = synthetic_frames(args)
+        else:
+            frames = prefetch_frames(
+                files, load, args.prefetch_depth, executor)
+        while True:
+            # NOTE: load time is the time spent waiting for the (prefetched) frame
+            start = time.perf_counter()
+            frame = next(frames, None)
+            load_sec = time.perf_counter() - start
+            if frame is None:
+                break
+            id, pcd = frame
+            print('id:', id)
+            rerun_sender.set_time_sequence("id", id)
+            ply_sender.log(
+                pcd,
+                args.point_size,
+                args.division_number,
+                args.block_number,
+                args.stride,
+                args.splitting_method,
+                args.enable_diff_by_index,
+                args.enable_diff_by_position,
+                args.cell_size,
+                args.lod_order,
+                args.lod_initial_points,
+                args.lod_growth,
+                args.lod_points_per_sec,
+                args.lod_bytes_per_sec,
+                load_sec=load_sec,
+            )
+            if barrier is not None:
+                # NOTE: keep all workers on the same frame
+                barrier.wait()
+    rerun_sender.shutdown()
+
+
+def run_workers(args, files):
+    if args.spawn:
+        print('[ERR] --spawn can not be used with --workers')
+        return
+    if args.recording_id is None:
+        args.recording_id = str(uuid.uuid4())
+        print('recording_id:', args.recording_id)
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.workers)
+    workers = [
+        context.Process(
+            target=run,
+            args=(args, files, shard_index, args.workers, barrier))
+        for shard_index in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(timeout=0.1)
+            if worker.exitcode not in (None, 0):
+                # NOTE: release the other workers waiting at the barrier
+                barrier.abort()
+    failed = [i for i, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        print(f'[ERR] workers {failed} failed')
+        return
+    print(f'[INFO] {args.workers} workers finished')
+    if args.save:
+        shard_paths = [rrd_tools.shard_rrd_path(args.save, i)
+                       for i in range(args.workers)]
+        rrd_tools.compact_rrd(shard_paths, args.save)
+        for shard_path in shard_paths:
+            os.remove(shard_path)
+        print('[INFO] merged into', args.save)
 
 
 def main():
@@ -197,6 +713,14 @@ def main():
     parser.add_argument('--addr', default='127.0.0.1:9876')
     parser.add_argument('-a', '--app-title', default='no_app_name')
     parser.add_argument('--recording_id', default=None)
+    parser.add_argument(
+        '--save',
+        default=None,
+        help='write the recording to this .rrd file instead of streaming it')
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='compact the --save file into large chunks at exit')
     parser.add_argument(
         '--block-number',
         default=1000,
@@ -220,10 +744,117 @@ def main():
         default='overall',
         choices=[
             'overall',
-            'order'])
+            'order',
+            'spatial',
+            'lod'])
+    parser.add_argument(
+        '--cell-size',
+        default=0.5,
+        type=float,
+        help='voxel-grid cell size for --splitting-method=spatial (and --lod-order=voxel)')
+    parser.add_argument(
+        '--lod-order',
+        default='random',
+        choices=[
+            'random',
+            'voxel'],
+        help='coarse level sampling for --splitting-method=lod')
+    parser.add_argument(
+        '--lod-initial-points',
+        default=100000,
+        type=int,
+        help='number of points in the first (coarsest) lod level')
+    parser.add_argument(
+        '--lod-growth',
+        default=4.0,
+        type=float,
+        help='growth factor of the points sent up to each lod level')
+    parser.add_argument(
+        '--lod-points-per-sec',
+        default=0.0,
+        type=float,
+        help='points/sec budget for lod levels (0: unlimited)')
+    parser.add_argument(
+        '--lod-bytes-per-sec',
+        default=0.0,
+        type=float,
+        help='bytes/sec budget for lod levels (0: unlimited)')
     parser.add_argument('--enable-diff-by-index', action='store_true')
     parser.add_argument('--enable-diff-by-position', action='store_true')
+    parser.add_argument(
+        '--diff-tolerance',
+        default=1e-6,
+        type=float,
+        help='grid size for --enable-diff-by-position, points closer than this on every axis always match, 2x or more apart on an axis never (0: exact match)')
+    parser.add_argument(
+        '--diff-backend',
+        default='voxel',
+        choices=[
+            'voxel',
+            'numpy'],
+        help='key index for --enable-diff-by-position')
     parser.add_argument('--off-auto-index', action='store_true')
+    parser.add_argument(
+        '--prefetch-depth',
+        default=2,
+        type=int,
+        help='number of files loaded ahead of the current one (0: no prefetch)')
+    parser.add_argument('--prefetch-workers', default=2, type=int)
+    parser.add_argument(
+        '--prefetch-executor',
+        default='thread',
+        choices=[
+            'thread',
+            'process'])
+    parser.add_argument(
+        '--encoding',
+        default='compact',
+        choices=[
+            'raw',
+            'compact',
+            'local'],
+        help='raw: as loaded, compact: float32 positions/uint8 colors/single radius, local: compact relative to each block origin')
+    parser.add_argument(
+        '--instrumentation',
+        action='store_true',
+        help='log per-frame stage timings and counters under instrumentation/')
+    parser.add_argument(
+        '--workers',
+        default=1,
+        type=int,
+        help='number of sender processes, frames are sharded between them (points with a diff or --synthetic-frames)')
+    parser.add_argument(
+        '--synthetic-frames',
+        default=0,
+        type=int,
+        help='log N generated frames instead of ply files (0: off)')
+    parser.add_argument('--synthetic-points', default=1_000_000, type=int)
+    parser.add_argument(
+        '--synthetic-churn',
+        default=0.01,
+        type=float,
+        help='fraction of the visible points moved every frame')
+    parser.add_argument(
+        '--synthetic-locality',
+        default=1.0,
+        type=float,
+        help='fraction of the moved points taken from one spatially local region (the rest are scattered)')
+    parser.add_argument(
+        '--synthetic-color-mode',
+        default='height',
+        choices=synthetic_scene.COLOR_MODES)
+    parser.add_argument(
+        '--synthetic-sensor-range',
+        default=0.0,
+        type=float,
+        help='only points within this x range around the sensor are visible, the range wraps around the scene edges (0: whole scene)')
+    parser.add_argument(
+        '--synthetic-sensor-speed',
+        default=0.0,
+        type=float,
+        help='sensor movement along x per frame, the sensor wraps around the scene')
+    parser.add_argument('--synthetic-seed', default=0, type=int)
+    rerun_sender.add_queue_arguments(parser)
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('files', nargs='*')
 
@@ -233,55 +864,17 @@ def main():
         return
 
     files = args.files
-    if len(files) == 0:
+    if len(files) == 0 and args.synthetic_frames <= 0:
         print("[WARN] Please set ply files.")
         return
 
-    rr.init(
-        "{}".format(args.app_title),
-        recording_id=args.recording_id,
-        spawn=args.spawn)
-    if not args.spawn and args.addr:
-        rr.connect(addr=args.addr)
-
-        print('[raw input]', files)
-        files = files[args.offset:]
-        files = files[::args.interval]
-        print('[filtered input]:', files)
-
-        # cnt = 0
-        ply_sender = RerunPlySender()
-        for i, file in enumerate(files):
-            id = i
-            if not args.off_auto_index:
-                match = re.search('([0-9]+)\\.ply', file)
-                if match:
-                    id = int(match.group(1))
-            print('id:', id)
-            rr.set_time_sequence("id", id)
-            if file == 'example':
-                num_points = 10000 + i * 1000
-                pcd = load_example_point_clouds(num_points)
-                pcd.vertices[i * 1000:(i + 1) * 1000, :] += [0.1, 0.1, 0.1]
-                # if cnt == 2:
-                # pcd.vertices = pcd.vertices[:1000]
-                # if cnt == 4:
-                # pcd.vertices = np.delete(pcd.vertices, 1, 0)
-            else:
-                pcd = load_plyfile(file)
-            # if cnt == 3:
-                # pcd.vertices = np.delete(pcd.vertices, 1, 0)
-            # cnt += 1
-            ply_sender.log(
-                pcd,
-                args.point_size,
-                args.division_number,
-                args.block_number,
-                args.stride,
-                args.splitting_method,
-                args.enable_diff_by_index,
-                args.enable_diff_by_position,
-            )
+    if args.workers > 1:
+        run_workers(args, files)
+        return
+    run(args, files)
+    if args.save and args.compact:
+        rrd_tools.compact_rrd([args.save], args.save)
+        print('[INFO] compacted', args.save)
 
 
 if __name__ == "__main__":
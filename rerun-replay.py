@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import csv
+import importlib.util
+import os
+
+import numpy as np
+
+import rate_control
+import replay_index
+import rerun_sender
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_script(filename, name):
+    filepath = os.path.join(SCRIPT_DIR, filename)
+    spec = importlib.util.spec_from_file_location(name, filepath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+rerun_ply = import_script('rerun-ply.py', 'rerun_ply')
+csv_pipe = import_script('csv-pipe-rerun.py', 'csv_pipe_rerun')
+
+
+def replay_csv(args, path, executor):
+    index = replay_index.load_csv_index(
+        path, args.index_rows, args.rebuild_index)
+    header = next(csv.reader([index['header']]))
+    print('header:', header)
+    csv_pipe.log_styles(args.title, header, {}, args.marker_size,
+                        np.random.RandomState(args.color_seed))
+
+    ranges = replay_index.csv_byte_ranges(
+        index, args.start, args.end, args.chunk_bytes)
+    print('[INFO] {} byte ranges, {} bytes'.format(
+        len(ranges), sum(end - begin for begin, end in ranges)))
+    rows_per_sec = args.step_rate * args.speed
+    controller = rate_control.RateController(
+        rows_per_sec, report_sec=args.report_sec, label='replay')
+    # NOTE: send about 100ms worth of rows at once, so pacing stays smooth
+    batch_rows = max(1, int(rows_per_sec * 0.1)) if rows_per_sec > 0 else 10000
+
+    def load(i, byte_range):
+        return replay_index.read_csv_range(path, byte_range)
+
+    for table in rerun_ply.prefetch_frames(
+            ranges, load, args.read_ahead, executor):
+        if len(table) == 0:
+            continue
+        # the first and last range may start/end between the requested steps
+        mask = np.ones(len(table), dtype=bool)
+        if args.start is not None:
+            mask &= table[:, 0] >= args.start
+        if args.end is not None:
+            mask &= table[:, 0] <= args.end
+        table = table[mask]
+        for offset in range(0, len(table), batch_rows):
+            rows = table[offset:offset + batch_rows]
+            controller.wait(len(rows), rows.nbytes)
+            csv_pipe.send_columns(args.title, header, rows)
+            controller.consume(len(rows), rows.nbytes)
+            controller.report()
+    controller.report(force=True)
+
+
+def replay_ply(args, files, executor):
+    index_path = args.ply_index or os.path.join(
+        os.path.dirname(os.path.abspath(files[0])), 'ply-index.json')
+    entries = replay_index.load_ply_index(
+        index_path, files, args.off_auto_index, args.read_workers)
+    entries = replay_index.select_entries(entries, args.start, args.end)
+    print('[INFO] replay {} files'.format(len(entries)))
+
+    # NOTE: a file identical to the previous one is not loaded nor sent,
+    # it still takes its time slot
+    duplicated = [i > 0 and entry['hash'] == entries[i - 1]['hash']
+                  for i, entry in enumerate(entries)]
+
+    def load(i, entry):
+        if duplicated[i]:
+            return None
+        return rerun_ply.load_plyfile(entry['path'])
+
+    ply_sender = rerun_ply.RerunPlySender(encoding=args.encoding)
+    controller = rate_control.RateController(
+        args.fps * args.speed, report_sec=args.report_sec, label='replay')
+    frames = rerun_ply.prefetch_frames(entries, load, args.read_ahead,
+                                       executor)
+    for entry, pcd in zip(entries, frames):
+        controller.wait()
+        if pcd is not None:
+            print('id:', entry['id'])
+            rerun_sender.set_time_sequence("id", entry['id'])
+            ply_sender.log(pcd, args.point_size,
+                           splitting_method=args.splitting_method)
+        controller.consume(1, entry['size'] if pcd is not None else 0)
+        controller.report()
+    controller.report(force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-s', '--spawn', action='store_true')
+    parser.add_argument('--addr', default='127.0.0.1:9876')
+    parser.add_argument('-a', '--app-title', default='no_app_name')
+    parser.add_argument('-t', '--title', default='no_graph_name')
+    parser.add_argument('-c', '--color-seed', default=0, type=int)
+    parser.add_argument('--recording_id', default=None)
+    parser.add_argument(
+        '--save',
+        default=None,
+        help='write the replay to this .rrd file instead of streaming it')
+    parser.add_argument(
+        '--start',
+        default=None,
+        type=int,
+        help='first step (csv) or file id (ply) to replay')
+    parser.add_argument(
+        '--end',
+        default=None,
+        type=int,
+        help='last step (csv) or file id (ply) to replay')
+    parser.add_argument(
+        '--speed',
+        default=1.0,
+        type=float,
+        help='replay speed factor (0: as fast as possible)')
+    parser.add_argument(
+        '--step-rate',
+        default=10.0,
+        type=float,
+        help='csv rows/sec at --speed 1')
+    parser.add_argument(
+        '--fps',
+        default=1.0,
+        type=float,
+        help='ply files/sec at --speed 1')
+    parser.add_argument(
+        '--read-ahead',
+        default=4,
+        type=int,
+        help='number of csv ranges or ply files read ahead')
+    parser.add_argument('--read-workers', default=4, type=int)
+    parser.add_argument(
+        '--chunk-bytes',
+        default=8 << 20,
+        type=int,
+        help='bytes per csv read-ahead range')
+    parser.add_argument(
+        '--index-rows',
+        default=4096,
+        type=int,
+        help='index the byte offset of every N-th csv row')
+    parser.add_argument('--rebuild-index', action='store_true')
+    parser.add_argument(
+        '--ply-index',
+        default=None,
+        help='ply index file (default: ply-index.json next to the first file)')
+    parser.add_argument('--off-auto-index', action='store_true')
+    parser.add_argument('--marker_size', default=2)
+    parser.add_argument('--point-size', default=0.001, type=float)
+    parser.add_argument(
+        '--splitting-method',
+        default='overall',
+        choices=[
+            'overall',
+            'order',
+            'spatial',
+            'lod'])
+    parser.add_argument(
+        '--encoding',
+        default='compact',
+        choices=[
+            'raw',
+            'compact',
+            'local'])
+    parser.add_argument(
+        '--report-sec',
+        type=float,
+        default=5.0,
+        help='interval of throughput report (0: only at exit)')
+    rerun_sender.add_queue_arguments(parser)
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    files = args.files
+    if len(files) == 0:
+        print("[WARN] Please set a csv file or ply files.")
+        return
+    is_csv = all(file.endswith('.csv') for file in files)
+    if is_csv and len(files) > 1:
+        print("[ERR] Only one csv file can be replayed at once.")
+        return
+
+    rerun_sender.init(
+        "{}".format(args.app_title),
+        recording_id=args.recording_id,
+        spawn=args.spawn,
+        addr=args.addr,
+        save=args.save,
+        queue_size=args.queue_size,
+        queue_policy=args.queue_policy,
+        report_sec=args.report_sec)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.read_workers) as executor:
+        if is_csv:
+            replay_csv(args, files[0], executor)
+        else:
+            replay_ply(args, files, executor)
+    rerun_sender.shutdown()
+
+
+if __name__ == "__main__":
+    main()
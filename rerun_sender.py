@@ -0,0 +1,230 @@
+import collections
+import threading
+import time
+
+import rerun as rr
+
+QUEUE_POLICIES = ['block', 'drop', 'coalesce']
+
+
+def init_rerun(app_title, recording_id=None, spawn=False, addr=None,
+               save=None):
+    rr.init(app_title, recording_id=recording_id, spawn=spawn)
+    if save:
+        rr.save(save)
+    elif not spawn and addr:
+        rr.connect(addr=addr)
+
+
+class LogQueue:
+
+    def __init__(self, maxsize=0, policy='block', report_sec=0.0,
+                 label='queue'):
+        # NOTE: maxsize <= 0 means no queue, every call is sent inline
+        self.maxsize = maxsize
+        self.policy = policy
+        self.report_sec = report_sec
+        self.label = label
+        self.times = {}
+        self.items = collections.deque()
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.max_depth = 0
+        self.counts = collections.Counter()
+        self.blocked_sec = 0.0
+        self.report_start = time.monotonic()
+        self.thread = None
+        if maxsize > 0:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def set_time_sequence(self, timeline, sequence):
+        if self.thread is None:
+            rr.set_time_sequence(timeline, sequence)
+            return
+        # timelines are thread-local in rerun, each item carries its own
+        self.times[timeline] = sequence
+
+    def log(self, entity, *archetypes, timeless=False, droppable=None):
+        # NOTE: droppable defaults to not timeless, pass False for data that is
+        # sent only once (e.g. only when it changed)
+        if self.thread is None:
+            rr.log(entity, *archetypes, timeless=timeless)
+            return
+        if droppable is None:
+            droppable = not timeless
+        key = (entity,) + tuple(type(archetype).__name__
+                                for archetype in archetypes)
+        self.put(key, droppable, rr.log, (entity,) + archetypes,
+                 {'timeless': timeless})
+
+    def send_columns(self, entity, times, components):
+        if self.thread is None:
+            rr.send_columns(entity, times=times, components=components)
+            return
+        # NOTE: column batches are ranges of data, never replace them with a newer batch
+        self.put(None, True, rr.send_columns, (entity,),
+                 {'times': times, 'components': components})
+
+    def put(self, key, droppable, fn, args, kwargs):
+        item = [key, droppable, dict(self.times), fn, args, kwargs]
+        with self.condition:
+            self.counts['put'] += 1
+            pending = self.pending.get(key) if key is not None else None
+            full = len(self.items) >= self.maxsize
+            if self.policy == 'coalesce' and full and droppable \
+                    and pending is not None and pending[1]:
+                # only when full: latest value wins while the item is still waiting
+                pending[2:] = item[2:]
+                self.counts['coalesced'] += 1
+                return
+            # NOTE: timeless items (styles, static geometry) and the ones logged with
+        # droppable=False are never dropped
+            while droppable and len(self.items) >= self.maxsize:
+                if self.policy == 'block':
+                    start = time.monotonic()
+                    self.condition.wait()
+                    self.blocked_sec += time.monotonic() - start
+                elif not self.drop_oldest():
+                    break
+            self.items.append(item)
+            if key is not None:
+                self.pending[key] = item
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.condition.notify_all()
+
+    def drop_oldest(self):
+        for i, item in enumerate(self.items):
+            if not item[1]:
+                continue
+            del self.items[i]
+            if self.pending.get(item[0]) is item:
+                del self.pending[item[0]]
+            self.counts['dropped'] += 1
+            return True
+        return False
+
+    def run(self):
+        applied_times = {}
+        while True:
+            with self.condition:
+                while not self.items and not self.closed:
+                    self.condition.wait()
+                if not self.items:
+                    return
+                item = self.items.popleft()
+                if self.pending.get(item[0]) is item:
+                    del self.pending[item[0]]
+                self.condition.notify_all()
+            key, _, times, fn, args, kwargs = item
+            if times != applied_times:
+                rr.reset_time()
+                for timeline, sequence in times.items():
+                    rr.set_time_sequence(timeline, sequence)
+                applied_times = times
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print('[ERR] {} failed to send {}: {}'.format(
+                    self.label, key, e))
+            with self.condition:
+                self.counts['sent'] += 1
+            self.report()
+
+    def close(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.report(force=True)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'depth': len(self.items),
+                'max_depth': self.max_depth,
+                'put': self.counts['put'],
+                'sent': self.counts['sent'],
+                'dropped': self.counts['dropped'],
+                'coalesced': self.counts['coalesced'],
+                'blocked_sec': self.blocked_sec,
+            }
+
+    def report(self, force=False):
+        now = time.monotonic()
+        elapsed = now - self.report_start
+        if not force and (self.report_sec <= 0 or elapsed < self.report_sec):
+            return
+        stats = self.stats()
+        print('[{}] depth {} (max {}), sent {} items, dropped {}, coalesced {}, blocked {:.3f}s'.format(
+            self.label,
+            stats['depth'],
+            stats['max_depth'],
+            stats['sent'],
+            stats['dropped'],
+            stats['coalesced'],
+            stats['blocked_sec']))
+        self.report_start = now
+
+
+# NOTE: like rerun's global recording, scripts log through a process-wide queue
+_queue = LogQueue()
+_init_args = {}
+
+
+def init(app_title, recording_id=None, spawn=False, addr=None, save=None,
+         queue_size=0, queue_policy='block', report_sec=0.0, label='queue'):
+    global _queue
+    _init_args.update(app_title=app_title, spawn=spawn, addr=addr, save=save)
+    init_rerun(app_title, recording_id, spawn, addr, save)
+    _queue = LogQueue(queue_size, queue_policy, report_sec, label)
+    return _queue
+
+
+def rotate(recording_id):
+    # NOTE: continue in a new recording, the viewer can drop the old one as a whole
+    global _queue
+    _queue.close()
+    rr.disconnect()
+    init_rerun(recording_id=recording_id, **_init_args)
+    _queue = LogQueue(_queue.maxsize, _queue.policy, _queue.report_sec,
+                      _queue.label)
+    return _queue
+
+
+def set_time_sequence(timeline, sequence):
+    _queue.set_time_sequence(timeline, sequence)
+
+
+def log(entity, *archetypes, timeless=False, droppable=None):
+    _queue.log(entity, *archetypes, timeless=timeless, droppable=droppable)
+
+
+def send_columns(entity, times, components):
+    _queue.send_columns(entity, times, components)
+
+
+def stats():
+    return _queue.stats()
+
+
+def shutdown():
+    # NOTE: drain the queue before disconnecting, worker processes skip atexit handlers
+    _queue.close()
+    rr.disconnect()
+
+
+def add_queue_arguments(parser):
+    parser.add_argument(
+        '--queue-size',
+        default=0,
+        type=int,
+        help='number of log calls buffered in front of the viewer connection (0: send inline)')
+    parser.add_argument(
+        '--queue-policy',
+        default='block',
+        choices=QUEUE_POLICIES,
+        help='when the queue is full, block: wait, drop: drop the oldest item, coalesce: replace a pending item of the same entity (else drop the oldest)')
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+
+    def __init__(self, capacity):
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.head = 0
+        self.size = 0
+
+    def append(self, step, value):
+        self.steps[self.head] = step
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.steps)
+        self.size = min(self.size + 1, len(self.steps))
+
+    def extend(self, steps, values):
+        steps = steps[-len(self.steps):]
+        values = values[-len(self.steps):]
+        index = (self.head + np.arange(len(steps))) % len(self.steps)
+        self.steps[index] = steps
+        self.values[index] = values
+        self.head = (self.head + len(steps)) % len(self.steps)
+        self.size = min(self.size + len(steps), len(self.steps))
+
+    def window(self):
+        # oldest first
+        start = (self.head - self.size) % len(self.steps)
+        index = (start + np.arange(self.size)) % len(self.steps)
+        return (self.steps[index], self.values[index])
+
+
+class RetentionWindow:
+
+    def __init__(self, capacity, republish_sec):
+        # NOTE: memory is bounded by capacity samples per series in the sender,
+        # the viewer is bounded by starting a new recording every republish_sec
+        self.capacity = capacity
+        self.republish_sec = republish_sec
+        self.series = {}
+        self.published = time.monotonic()
+        self.epoch = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0 and self.republish_sec > 0
+
+    def append(self, entity, step, value):
+        if not self.enabled:
+            return
+        if entity not in self.series:
+            self.series[entity] = RingBuffer(self.capacity)
+        self.series[entity].append(step, value)
+
+    def extend(self, entity, steps, values):
+        if not self.enabled:
+            return
+        if entity not in self.series:
+            self.series[entity] = RingBuffer(self.capacity)
+        self.series[entity].extend(steps, values)
+
+    def due(self):
+        if not self.enabled:
+            return False
+        return time.monotonic() - self.published >= self.republish_sec
+
+    def windows(self):
+        self.published = time.monotonic()
+        self.epoch += 1
+        for entity, ring in self.series.items():
+            if ring.size:
+                yield (entity,) + ring.window()
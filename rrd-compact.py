@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+import rrd_tools
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument(
+        '--max-rows',
+        default=4096,
+        type=int,
+        help='max rows per compacted chunk')
+    parser.add_argument(
+        '--max-bytes',
+        default=4 * 1024 * 1024,
+        type=int,
+        help='max bytes per compacted chunk')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    input_bytes = sum(os.path.getsize(file) for file in args.files)
+    rrd_tools.compact_rrd(args.files, args.output,
+                          args.max_rows, args.max_bytes)
+    output_bytes = os.path.getsize(args.output)
+    print(f'{len(args.files)} files ({input_bytes} bytes) -> {args.output} ({output_bytes} bytes)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+
+def compact_rrd(inputs, output, max_rows=None, max_bytes=None):
+    # NOTE: 'rerun rrd compact' merges all inputs into one recording with large chunks
+    tmp_output = output + '.tmp'
+    command = [sys.executable, '-m', 'rerun', 'rrd', 'compact']
+    command += list(inputs)
+    command += ['-o', tmp_output]
+    if max_rows:
+        command += ['--max-rows', str(max_rows)]
+    if max_bytes:
+        command += ['--max-bytes', str(max_bytes)]
+    subprocess.run(command, check=True)
+    os.replace(tmp_output, output)
+
+
+def shard_rrd_path(path, shard_index):
+    root, ext = os.path.splitext(path)
+    return '{}-{}{}'.format(root, shard_index, ext or '.rrd')
@@ -0,0 +1,129 @@
+import numpy as np
+
+COLOR_MODES = ['height', 'random', 'churn', 'none']
+
+
+class SyntheticVisual:
+
+    def __init__(self, vertex_colors):
+        self.vertex_colors = vertex_colors
+
+
+class SyntheticPointCloud:
+
+    def __init__(self, vertices, colors=None):
+        self.vertices = vertices
+        if colors is not None:
+            self.visual = SyntheticVisual(colors)
+
+
+class SyntheticScene:
+
+    def __init__(self, num_points=1_000_000, churn=0.01, locality=1.0,
+                 color_mode='height', sensor_speed=0.0, sensor_range=None,
+                 extent=10.0, displacement=0.01, seed=0, dtype=np.float32):
+        self.rng = np.random.default_rng(seed)
+        self.num_points = num_points
+        self.churn = churn
+        self.locality = locality
+        self.color_mode = color_mode
+        self.sensor_speed = sensor_speed
+        self.sensor_range = sensor_range
+        self.extent = extent
+        self.displacement = displacement
+
+        positions = self.rng.random((num_points, 3), dtype=dtype) * extent
+        # NOTE: sort by (x, y, z) cells, so index ranges are spatially local and
+        # a sensor window along x is a contiguous slice
+        self.num_cells = 16
+        self.cell_size = extent / self.num_cells
+        # float32 rounding can put a point exactly on extent, keep it in the last cell
+        cells = np.minimum(np.floor(positions / self.cell_size).astype(np.int64),
+                           self.num_cells - 1)
+        order = np.lexsort((cells[:, 2], cells[:, 1], cells[:, 0]))
+        positions = positions[order]
+        # the x cells are sorted and, unlike the churned positions, never change
+        self.x_cells = cells[order, 0]
+
+        # double buffer: the previous frame stays valid while the next one is written
+        self.buffers = [positions, np.empty_like(positions)]
+        self.current = 0
+        self.colors = self.make_colors(positions)
+        self.frame_index = 0
+
+    def make_colors(self, positions):
+        if self.color_mode == 'none':
+            return None
+        if self.color_mode == 'random':
+            return self.rng.integers(
+                0, 256, (len(positions), 3), dtype=np.uint8)
+        z = positions[:, 2] / self.extent
+        colors = np.empty((len(positions), 3), dtype=np.uint8)
+        colors[:, 0] = np.clip(z * 255, 0, 255)
+        colors[:, 1] = 64
+        colors[:, 2] = np.clip((1.0 - z) * 255, 0, 255)
+        return colors
+
+    def churn_indices(self, begin, end):
+        # NOTE: end can be past num_points when the window wraps, the caller
+        # takes the indices modulo num_points
+        n = end - begin
+        n_churn = int(n * self.churn)
+        if n_churn == 0:
+            return np.zeros(0, dtype=np.int64)
+        n_local = int(n_churn * self.locality)
+        start = begin + int(self.rng.integers(0, max(n - n_local, 0) + 1))
+        local = np.arange(start, start + n_local)
+        scattered = self.rng.integers(begin, end, n_churn - n_local)
+        return np.concatenate((local, scattered))
+
+    def window(self):
+        if self.sensor_range is None:
+            return (0, self.num_points)
+        # sensor moves along x and wraps around the scene, the window covers
+        # whole x cells; past an edge it continues from the other side, then
+        # end is past num_points and indices are taken modulo num_points
+        center = (self.frame_index * self.sensor_speed) % self.extent
+        first = int(np.floor((center - self.sensor_range / 2) / self.cell_size))
+        last = int(np.floor((center + self.sensor_range / 2) / self.cell_size))
+        if last - first + 1 >= self.num_cells:
+            return (0, self.num_points)
+        first %= self.num_cells
+        last %= self.num_cells
+        begin = int(np.searchsorted(self.x_cells, first, 'left'))
+        end = int(np.searchsorted(self.x_cells, last, 'right'))
+        if last < first:
+            end += self.num_points
+        return (begin, end)
+
+    def next_frame(self):
+        previous = self.buffers[self.current]
+        self.current = 1 - self.current
+        positions = self.buffers[self.current]
+        np.copyto(positions, previous)
+
+        begin, end = self.window()
+        if self.frame_index > 0:
+            index = self.churn_indices(begin, end)
+            if end > self.num_points:
+                index %= self.num_points
+            positions[index] += self.rng.normal(
+                0, self.displacement, (len(index), 3)).astype(positions.dtype)
+            if self.color_mode == 'churn':
+                self.colors[index] = [255, 0, 255]
+        self.frame_index += 1
+
+        return SyntheticPointCloud(self.visible(positions, begin, end),
+                                   self.visible(self.colors, begin, end))
+
+    def visible(self, values, begin, end):
+        # a view unless the window wraps, then the tail and the head are joined
+        if values is None:
+            return None
+        if end <= self.num_points:
+            return values[begin:end]
+        return np.concatenate((values[begin:], values[:end - self.num_points]))
+
+    def frames(self, num_frames):
+        for _ in range(num_frames):
+            yield self.next_frame()